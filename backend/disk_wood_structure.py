@@ -5,6 +5,7 @@ import numpy as np
 from shapely.geometry import Polygon, Point
 
 from lib.image import Color, Drawing
+from lib.geometry import rings_geometry, pack_rings, region_centroid
 
 """
 Generic Cross Section Tree structure
@@ -61,17 +62,47 @@ class AnnualRing(DiskWoodStructure):
         else:
             self.late_wood = self
 
+        self._geometry = None
 
-
-
-
-    def get_centroid(self):
-        outter_boundary = Polygon(self.exterior)
-        return outter_boundary.centroid
+    def _get_geometry(self):
+        """
+        Area, perimeter and centroid of the exterior and the hole boundaries, computed once with the shoelace kernel
+        @return: (areas, perimeters, centroids) of [exterior, hole]. The hole row is zero when there is no hole
+        """
+        if self._geometry is None:
+            l_rings = [self.external_points]
+            if self.internal_points is not None:
+                l_rings.append(self.internal_points)
+            area, perimeter, centroid, _ = rings_geometry(*pack_rings(l_rings))
+            if self.internal_points is None:
+                area, perimeter = np.append(area, 0), np.append(perimeter, 0)
+                centroid = np.vstack((centroid, centroid))
+            self._geometry = (area, perimeter, centroid)
+        return self._geometry
+
+    def get_area(self):
+        """Area between the exterior and the hole"""
+        area, _, _ = self._get_geometry()
+        return area[0] - area[1]
+
+    def get_perimeter(self):
+        """Exterior boundary length"""
+        _, perimeter, _ = self._get_geometry()
+        return perimeter[0]
+
+    def get_centroid(self, region=False):
+        """
+        Centroid of the exterior boundary. If region, centroid of the area between the exterior and the hole
+        @return: shapely point
+        """
+        area, _, centroid = self._get_geometry()
+        if region:
+            return Point(region_centroid(area[0], centroid[0], area[1], centroid[1]))
+        return Point(centroid[0])
 
     def similarity_factor(self):
-        perimeter = self.exterior.length
-        area = self.area
+        perimeter = self.get_perimeter()
+        area = self.get_area()
         radii_perfect_circle = np.sqrt(area / np.pi)
         ring_similarity_factor = 1 - (perimeter - 2*np.pi*radii_perfect_circle) / perimeter
         return ring_similarity_factor
@@ -94,20 +125,7 @@ class AnnualRing(DiskWoodStructure):
                 image = self.early_wood.draw(image, Color.green, thickness, opacity, False)
 
         else:
-            mask_exterior = np.zeros_like(image)
-            mask_exterior = Drawing.fill(self.exterior.coords, mask_exterior, Color.white, opacity=1)
-            ######
-            mask_interiors = np.zeros_like(image)
-            inner_points = np.array([list(interior.coords) for interior in self.interiors]).squeeze()
-            if len(inner_points)>0:
-                aux_poly = Polygon(inner_points)
-                mask_interiors = Drawing.fill(aux_poly.exterior.coords, mask_interiors,  Color.white, opacity=1)
-
-            mask = mask_exterior - mask_interiors
-
-            y,x = np.where(mask[:,:,0]>0)
-            mask[y,x] = color
-            cv2.addWeighted(mask, opacity, image, 1 - opacity, 0, image)
+            image = Drawing.fill_region(image, self.external_points, self.internal_points, color, opacity)
 
 
         return image
@@ -7,8 +7,11 @@ from pathlib import Path
 from typing import List
 
 from shapely.geometry import Polygon, Point
+from shapely.prepared import prep
 from lib.io import load_json, write_json
-from lib.image import Color, Drawing, load_image
+from lib.image import Color, Drawing, get_image_info
+from lib.geometry import ring_geometry, rings_geometry, pack_rings
+from lib.labelme_cache import LabelmeArrays, labelme_json_to_arrays, load_labelme_arrays
 from backend.abstraction_layer import UserInterface
 from backend.disk_wood_structure import AnnualRing
 
@@ -20,11 +23,17 @@ class LabelmeShapeType:
 
 
 class LabelmeShape:
-    def __init__(self, shape):
+    def __init__(self, shape, points = None):
+        """
+        @param shape: labelme shape dictionary
+        @param points: shape points already converted to (y, x) array. If None, they are taken from shape['points']
+        """
         self.label = shape['label']
-        self.points = np.array(shape['points'])[:,[1,0]]
+        self.points = np.array(shape['points'])[:,[1,0]] if points is None else points
         self.shape_type = shape['shape_type']
         self.flags = shape['flags']
+        # area, perimeter, centroid and bounds, computed once. See set_geometry
+        self._geometry = None
 
     def to_dict(self):
         return dict(
@@ -40,15 +49,68 @@ class LabelmeShape:
     def __repr__(self):
         return f"(main_label={self.label}, shape_type={self.shape_type}, size = {self.points.shape})"
 
+    def set_geometry(self, area, perimeter, centroid, bounds):
+        self._geometry = (area, perimeter, centroid, bounds)
+
+    def _get_geometry(self):
+        if self._geometry is None:
+            self.set_geometry(*ring_geometry(self.points))
+        return self._geometry
+
     def area(self):
-        poly  = Polygon(self.points)
-        return poly.area
+        return self._get_geometry()[0]
+
+    def perimeter(self):
+        return self._get_geometry()[1]
+
+    def centroid(self):
+        """
+        @return: (y, x) centroid
+        """
+        return self._get_geometry()[2]
+
+    def bounds(self):
+        """
+        @return: (y_min, x_min, y_max, x_max) bounding box
+        """
+        return self._get_geometry()[3]
+
+
+def compute_shapes_geometry(shapes: List[LabelmeShape]):
+    """
+    Fill the geometry cache of the shapes that do not have it, computing all of them in one batch
+    @param shapes: labelme shapes
+    """
+    shapes = [shape for shape in shapes if shape._geometry is None]
+    if len(shapes) == 0:
+        return
+    area, perimeter, centroid, bounds = rings_geometry(*pack_rings([shape.points for shape in shapes]))
+    for idx, shape in enumerate(shapes):
+        shape.set_geometry(area[idx], perimeter[idx], centroid[idx], bounds[idx])
+
+
+def sort_shapes_by_area(shapes: List[LabelmeShape]):
+    """
+    Sort shapes by ascending area. Areas are computed in one batch, only for the shapes without cached geometry.
+    Equal areas keep their order.
+    """
+    compute_shapes_geometry(shapes)
+    order = np.argsort([shape.area() for shape in shapes], kind='stable')
+    return [shapes[idx] for idx in order]
+
 
 class LabelmeObject:
-    def __init__(self, json_labelme_path = None):
+    def __init__(self, json_labelme_path = None, load_image_data = False):
+        """
+        @param json_labelme_path: labelme json file to parse
+        @param load_image_data: if False, the base64 imageData field is skipped and loaded as None, and the shapes are
+        read from the binary cache of the file (see lib.labelme_cache)
+        """
         if json_labelme_path is not None:
-            labelme_json = load_json(json_labelme_path)
-            self.parser(labelme_json)
+            if load_image_data:
+                self.parser(load_json(json_labelme_path))
+            else:
+                self.from_arrays(load_labelme_arrays(json_labelme_path))
 
     def from_memory(self, version : str = "5.0", flags : dict = None, shapes : List[LabelmeShape] = None,
                     imagePath : str = "", imageData : str = "", imageHeight : str = "",
@@ -74,19 +136,30 @@ class LabelmeObject:
             imageWidth = self.imageWidth
         )
     def parser(self, labelme_json):
-        self.version = labelme_json["version"]
-        self.flags = labelme_json["flags"]
-        self.shapes = [LabelmeShape(shape) for shape in  labelme_json["shapes"]]
+        self.from_arrays(labelme_json_to_arrays(labelme_json), labelme_json.get("imageData"))
+
+    def from_arrays(self, arrays: LabelmeArrays, imageData = None):
+        """
+        Build the object from the concatenated labelme arrays. Each shape points is a view of arrays.points and its
+        geometry is taken from arrays.geometry
+        """
+        header = arrays.header
+        self.version = header["version"]
+        self.flags = header["flags"]
+        self.shapes = []
+        for idx, shape in enumerate(arrays.shapes):
+            labelme_shape = LabelmeShape(shape, arrays.get_shape_points(idx))
+            labelme_shape.set_geometry(*arrays.get_shape_geometry(idx))
+            self.shapes.append(labelme_shape)
         if len(self.shapes)> 0:
             check_if_all_shapes_are_polygon = (len([s for s in self.shapes if s.shape_type == LabelmeShapeType.polygon])
                                                ==len(self.shapes))
             if check_if_all_shapes_are_polygon:
-                self.shapes.sort(key=lambda x: x.area())
-        self.imagePath = labelme_json["imagePath"]
-        self.imageData = labelme_json["imageData"]
-        self.imageHeight = labelme_json["imageHeight"]
-        self.imageWidth = labelme_json["imageWidth"]
-
+                self.shapes = sort_shapes_by_area(self.shapes)
+        self.imagePath = header["imagePath"]
+        self.imageData = imageData
+        self.imageHeight = header["imageHeight"]
+        self.imageWidth = header["imageWidth"]
 
 
 class LabelmeInterface(UserInterface):
@@ -119,7 +192,10 @@ class LabelmeInterface(UserInterface):
     def read(self):
         labelme_parser = LabelmeObject(self.read_file_path)
         structure_list = [self.from_labelme_shape_to_structure(shape) for shape in labelme_parser.shapes]
-        structure_list.sort(key=lambda x: x.area())
+        if all(isinstance(structure, LabelmeShape) for structure in structure_list):
+            structure_list = sort_shapes_by_area(structure_list)
+        else:
+            structure_list.sort(key=lambda x: x.area())
         return structure_list
 
     @abstractmethod
@@ -147,10 +223,8 @@ class LabelmeInterface(UserInterface):
     @staticmethod
     def load_shapes(output_path):
         try:
-            json_content = load_json(output_path)
-            l_rings = []
-            for ring in json_content['shapes']:
-                l_rings.append(Polygon(np.array(ring['points'])[:, [1, 0]].tolist()))
+            arrays = load_labelme_arrays(output_path)
+            l_rings = [Polygon(arrays.get_shape_points(idx)) for idx in range(len(arrays))]
 
         except FileNotFoundError:
             l_rings = []
@@ -197,10 +271,8 @@ def resize_annotations( image_orig_path, image_resized_path, annotations_orig_pa
     :param annotations_orig_path: annotations made in the original resolution in labelme format
     :return: new annotation file path
     """
-    image_orig = load_image(image_orig_path)
-    H, W = image_orig.shape[:2]
-    image_r = load_image(image_resized_path)
-    h, w = image_r.shape[:2]
+    H, W, _ = get_image_info(image_orig_path)
+    h, w, _ = get_image_info(image_resized_path)
     gt_path_resized = str(annotations_orig_path).replace(".json", "resized.json")
     al = AL_LateWood_EarlyWood(annotations_orig_path,
                                gt_path_resized,
@@ -215,9 +287,124 @@ def resize_annotations( image_orig_path, image_resized_path, annotations_orig_pa
 
 
 
+def bounds_intersect(bounds_a, bounds_b):
+    """
+    @param bounds_a: (min0, min1, max0, max1) bounding box
+    @param bounds_b: (min0, min1, max0, max1) bounding box
+    @return: True if the bounding boxes intersect (touching included)
+    """
+    return not (bounds_a[2] < bounds_b[0] or bounds_b[2] < bounds_a[0] or
+                bounds_a[3] < bounds_b[1] or bounds_b[3] < bounds_a[1])
+
+
+def bounds_within(bounds_a, bounds_b):
+    """
+    @return: True if bounding box bounds_a is inside bounding box bounds_b
+    """
+    return (bounds_b[0] <= bounds_a[0] and bounds_b[1] <= bounds_a[1] and
+            bounds_a[2] <= bounds_b[2] and bounds_a[3] <= bounds_b[3])
+
+
+class EarlyWoodSweep:
+    """
+    Sort and sweep pairing of earlywood boundaries with latewood bands. Latewood bands are visited from the inner to the
+    outer one and earlywood rings are sorted by ascending area, so with nested rings the earlywood rings that lie
+    strictly inside the inner ring of a band also lie inside every outer band and are never visited again. Each
+    earlywood ring is then tested O(1) times. Bounding boxes and areas cached in the shapes discard most candidates
+    before any shapely predicate. These shortcuts only hold for nested rings: if the inner ring of a band does not cover
+    the inner ring of the former band the sweep starts again from the first earlywood ring, and if the outer ring of a
+    band does not cover its inner ring (invalid band polygon) every earlywood ring is tested with the plain shapely
+    predicate. Pairing is then the same as testing every earlywood ring against every band.
+    """
+    def __init__(self, early_rings_list: List[LabelmeShape], debug_image: np.ndarray = None):
+        """
+        @param early_rings_list: earlywood rings sorted by ascending area
+        @param debug_image: if not None, each band and its visited earlywood rings are drawn over a copy of it. The
+        images are stored in debug_images
+        """
+        self.early_rings_list = early_rings_list
+        self.early_polygons = [None] * len(early_rings_list)
+        self.start = 0
+        self.previous_inner_poly = None
+        self.debug_image = debug_image
+        self.debug_images = []
+
+    def _get_early_polygon(self, idx):
+        if self.early_polygons[idx] is None:
+            self.early_polygons[idx] = Polygon(self.early_rings_list[idx].points)
+        return self.early_polygons[idx]
+
+    def match(self, late_ring: LabelmeShape, previous_ring: LabelmeShape):
+        """
+        First earlywood ring, in ascending area order, that intersects the band between previous_ring and late_ring.
+        As the original pairing loop, if no earlywood ring intersects the band, the last earlywood ring is returned
+        @param late_ring: outer latewood ring of the band
+        @param previous_ring: inner latewood ring of the band
+        @return: earlywood ring, or None if previous_ring is None or there are no earlywood rings
+        """
+        if previous_ring is None:
+            return None
+        outter_poly = Polygon(late_ring.points)
+        inner_poly = Polygon(previous_ring.points)
+        if self.previous_inner_poly is not None and not inner_poly.covers(self.previous_inner_poly):
+            # rings are not nested. The skipped earlywood rings may intersect this band
+            self.start = 0
+        self.previous_inner_poly = inner_poly
+        region = Polygon(outter_poly.exterior.coords, [inner_poly.exterior.coords])
+        nested = outter_poly.covers(inner_poly)
+        if not nested:
+            self.start = 0
+        prepared_inner = prep(inner_poly)
+        prepared_region = None
+        image = None
+        if self.debug_image is not None:
+            image = draw_circular_region(self.debug_image.copy(), outter_poly, inner_poly, Color.red, 0.3)
+            self.debug_images.append(image)
+
+        early = None
+        for idx in range(self.start, len(self.early_rings_list)):
+            candidate = self.early_rings_list[idx]
+            poly_early = self._get_early_polygon(idx)
+            if image is not None:
+                Drawing.curve(poly_early.exterior, image, Color.blue, 1)
+
+            if not nested:
+                if poly_early.intersects(region):
+                    early = candidate
+                    break
+                continue
+
+            if (candidate.area() <= previous_ring.area() and bounds_within(candidate.bounds(), previous_ring.bounds())
+                    and prepared_inner.contains_properly(poly_early)):
+                # inside the inner ring of this band, and therefore of every outer band
+                if idx == self.start:
+                    self.start += 1
+                continue
+
+            if not bounds_intersect(candidate.bounds(), late_ring.bounds()):
+                continue
+
+            if prepared_region is None:
+                prepared_region = prep(region)
+            if prepared_region.intersects(poly_early):
+                early = candidate
+                break
+
+        if early is None and len(self.early_rings_list) > 0:
+            early = self.early_rings_list[-1]
+
+        return early
+
+
 class AL_AnnualRings:
 
-    def __init__(self, early_wood_path: Path = None, late_wood_path : Path = None):
+    def __init__(self, early_wood_path: Path = None, late_wood_path : Path = None, debug: bool = False):
+        """
+        @param early_wood_path: earlywood annotations file
+        @param late_wood_path: latewood annotations file
+        @param debug: if True, read draws each latewood band and the earlywood rings visited to pair it. The images
+        are stored in debug_images
+        """
         self.al_earlywood = None
         if early_wood_path is not None:
             early_read_path, early_write_path = self._generate_read_and_write_paths(early_wood_path)
@@ -228,6 +415,8 @@ class AL_AnnualRings:
 
         late_read_path, late_write_path = self._generate_read_and_write_paths(late_wood_path)
         self.al_latewood = AL_LateWood_EarlyWood(late_read_path, late_write_path)
+        self.debug = debug
+        self.debug_images = []
 
 
     def _generate_read_and_write_paths(self, file_path : Path):
@@ -237,28 +426,11 @@ class AL_AnnualRings:
         write_file_path = parent_dir / f"{file_name}_write.json"
         return read_file_path, write_file_path
 
-    def get_early_ring_within_late_rings(self, late_ring: LabelmeShape, previous_ring: LabelmeShape ,
-                                         early_rings_list: List[LabelmeShape],  image: np.array):
-        if previous_ring is None:
-            late_ring_poly = Polygon(late_ring.points)
-            return None
-        else:
-            late_ring_poly = Polygon(late_ring.points.tolist(),[previous_ring.points.tolist()])
-        ###
-        #early_rings_within_late_ring = [early for early in early_rings_list if Polygon(early.points).within(late_ring_poly)]
-        outter_poly = Polygon(late_ring.points)
-        inner_poly = Polygon(previous_ring.points)
-        image = draw_circular_region(image, outter_poly, inner_poly, Color.red, 0.3)
-        region = Polygon(outter_poly.exterior.coords, [inner_poly.exterior.coords])
-        early = None
-        for early in early_rings_list:
-            poly_early = Polygon(early.points)
-            image = Drawing.curve(poly_early.exterior, image, Color.blue, 1)
-            does_intersect = poly_early.intersects(region)
-            if does_intersect:
-                break
-
-        return early
+    @staticmethod
+    def _build_debug_image(structures: List[LabelmeShape]):
+        bounds = np.array([shape.bounds() for shape in structures]).reshape(-1, 4)
+        height, width = np.nan_to_num(np.nanmax(bounds[:, 2:], axis=0, initial=0)).astype(int) + 1
+        return np.zeros((height, width, 3), dtype=np.uint8)
 
     def read(self):
         late_structures = self.al_latewood.read()
@@ -269,14 +441,17 @@ class AL_AnnualRings:
         else:
             early_structures = None
 
+        sweep = None
+        if early_structures is not None:
+            debug_image = self._build_debug_image(late_structures + early_structures) if self.debug else None
+            sweep = EarlyWoodSweep(early_structures, debug_image)
+
         idx = 0
         previous = None
         list_annual_rings = []
-        height, width =1006, 900
-        image = np.zeros((height, width, 3), dtype=np.uint8)
         for late in late_structures:
             try:
-                early = self.get_early_ring_within_late_rings(late, previous, early_structures, image.copy()) if early_structures is not None else None
+                early = sweep.match(late, previous) if sweep is not None else None
 
 
                 if idx == 0:
@@ -295,6 +470,9 @@ class AL_AnnualRings:
             previous = late
             idx += 1
 
+        if sweep is not None:
+            self.debug_images = sweep.debug_images
+
         return list_annual_rings
 
 
@@ -45,7 +45,8 @@ class CSTRD(Model):
 
             points_list = []
             for poly in ia.gt_poly:
-                points_list.append([[int(x), int(y)] for x, y in poly.exterior.coords])
+                y, x = poly.get_coordinates(closed=True)
+                points_list.append([[int(i), int(j)] for i, j in zip(y, x)])
 
             al = AL_LateWood_EarlyWood(None,
                                        gt_path_resized,
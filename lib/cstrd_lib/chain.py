@@ -7,10 +7,12 @@ This program is distributed in the hope that it will be useful, but WITHOUT ANY
 
 You should have received a copy of the GNU Affero General Public License along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
+import weakref
 import numpy as np
 import matplotlib.pyplot as plt
 from typing import List
-from shapely.geometry import Polygon
+
+from lib.geometry import ring_area
 
 
 
@@ -27,6 +29,20 @@ def get_node_from_list_by_angle(dot_list, angle):
     return dot
 
 
+def build_angle_index(dot_list, angle_index=None):
+    """
+    Build an angle to node dictionary. When several nodes share the same angle, the first one in the list is kept, as
+    get_node_from_list_by_angle does.
+    @param dot_list: nodes list
+    @param angle_index: existing index to be updated
+    @return: angle index dictionary
+    """
+    angle_index = {} if angle_index is None else angle_index
+    for dot in dot_list:
+        angle_index.setdefault(dot.angle, dot)
+    return angle_index
+
+
 def get_chain_from_list_by_id(chain_list, chain_id):
     try:
         chain_in_list = next(chain for chain in chain_list if (chain.id == chain_id))
@@ -40,6 +56,8 @@ def get_chain_from_list_by_id(chain_list, chain_id):
 # Class Node
 ########################################################################################################################
 class Node:
+    __slots__ = ('x', 'y', 'chain_id', 'radial_distance', 'angle')
+
     def __init__(self, x, y, chain_id, radial_distance, angle):
         self.x = x
         self.y = y
@@ -87,6 +105,14 @@ class Chain:
     def __init__(self, chain_id: int, Nr: int, center, img_height: int, img_width: int,
                  type: TypeChains = TypeChains.normal, A_outward=None, A_inward=None, B_outward=None, B_inward=None):
         self.l_nodes = []
+        self.nodes_by_angle = {}
+        # nodes shared with the source chain of copy_chain. This chain copies them before modifying them
+        self._shared_nodes = None
+        # weak references to the copy_chain copies of this chain. They copy the shared nodes before this chain
+        # modifies them in place
+        self._copies = []
+        # lazy cache. It is cleared each time the nodes change
+        self._arrays = None
         self.id = chain_id
         self.size = 0
         self.Nr = Nr
@@ -114,36 +140,42 @@ class Chain:
         else:
             return False
 
+    @property
+    def clockwise_sorted_dots(self):
+        return self._sort_dots()
+
     def sort_dots(self, direction=ClockDirection.clockwise):
-        return self.clockwise_sorted_dots if direction == ClockDirection.clockwise else self.clockwise_sorted_dots[::-1]
+        return self._sort_dots(direction)
 
     def _sort_dots(self, direction=ClockDirection.clockwise):
-        clock_wise_sorted_dots = []
-        step = 360 / self.Nr
-        angle_k = self.extB.angle if direction == ClockDirection.clockwise else self.extA.angle
-        while len(clock_wise_sorted_dots) < self.size:
-            dot = self.get_node_by_angle(angle_k)
-            if dot is None:
-                continue
-            clock_wise_sorted_dots.append(dot)
-            angle_k = (angle_k - step) % 360 if direction == ClockDirection.clockwise else (angle_k + step) % 360
-
-        return clock_wise_sorted_dots
+        """
+        Nodes sorted from extB to extA (clockwise) or from extA to extB (anti clockwise). l_nodes is kept sorted by
+        angle and the endpoints are consecutive on it, so the sorted nodes are a rotation of l_nodes.
+        @param direction: clock direction
+        @return: new nodes list. It is not affected by later changes of the chain nodes
+        """
+        if direction == ClockDirection.clockwise:
+            return self.l_nodes[self.extBind::-1] + self.l_nodes[:self.extBind:-1]
+
+        return self.l_nodes[self.extAind:] + self.l_nodes[:self.extAind]
 
     def __repr__(self):
         return (f'(id_l:{self.label_id},id:{self.id}, size {self.size}')
 
     def __find_endpoints(self):
-        diff = np.zeros(self.size)
         extA_init = self.extA if self.extA is not None else None
         extB_init = self.extB if self.extB is not None else None
-        self.l_nodes.sort(key=lambda x: x.angle, reverse=False)
-        diff[0] = (self.l_nodes[0].angle + 360 - self.l_nodes[-1].angle) % 360
+        # stable sort by angle. Timsort is linear when merging the already sorted nodes with a few new ones
+        angles = np.fromiter((dot.angle for dot in self.l_nodes), dtype=float, count=self.size)
+        order = np.argsort(angles, kind='stable')
+        angles = angles[order]
+        self.l_nodes[:] = [self.l_nodes[i] for i in order]
 
-        for i in range(1, self.size):
-            diff[i] = (self.l_nodes[i].angle - self.l_nodes[i - 1].angle)
+        diff = np.empty(self.size)
+        diff[0] = (angles[0] + 360 - angles[-1]) % 360
+        diff[1:] = np.diff(angles)
 
-        border1 = diff.argmax()
+        border1 = int(diff.argmax())
         if border1 == 0:
             border2 = diff.shape[0] - 1
         else:
@@ -162,6 +194,7 @@ class Chain:
 
     def add_nodes_list(self, l_nodes):
         self.l_nodes += l_nodes
+        build_angle_index(l_nodes, self.nodes_by_angle)
         change_border = self.update()
         return change_border
 
@@ -169,15 +202,35 @@ class Chain:
         self.size = len(self.l_nodes)
         if self.size > 1:
             change_border = self.__find_endpoints()
-            self.clockwise_sorted_dots = self._sort_dots()
+            self._arrays = None
         else:
             raise
 
         return change_border
 
+    def get_arrays(self):
+        """
+        Nodes values as parallel numpy arrays, in l_nodes order (ascending angle). Arrays are cached until the nodes
+        change and are read only.
+        @return: angle, y, x and radial distance arrays
+        """
+        if self._arrays is None:
+            values = np.array([(dot.angle, dot.y, dot.x, dot.radial_distance) for dot in self.l_nodes],
+                              dtype=float).reshape(-1, 4).T.copy()
+            values.flags.writeable = False
+            self._arrays = values
+        return tuple(self._arrays)
+
+    def get_endpoints_arrays(self):
+        """
+        Views over the nodes arrays of extA and extB
+        @return: (angle, y, x, radial distance) views of extA and extB
+        """
+        self.get_arrays()
+        return self._arrays[:, self.extAind], self._arrays[:, self.extBind]
+
     def get_nodes_coordinates(self):
-        x = [dot.x for dot in self.l_nodes]
-        y = [dot.y for dot in self.l_nodes]
+        _, y, x, _ = self.get_arrays()
         x_rot = np.roll(x, -self.extAind)
         y_rot = np.roll(y, -self.extAind)
         return x_rot, y_rot
@@ -185,10 +238,47 @@ class Chain:
     def get_dot_angle_values(self):
         return [dot.angle for dot in self.l_nodes]
 
+    def _replace_nodes(self, l_nodes):
+        """
+        Replace the references to l_nodes by copies of them
+        """
+        copies = {id(node): copy_node(node) for node in l_nodes}
+        self.l_nodes = [copies.get(id(node), node) for node in self.l_nodes]
+        self.nodes_by_angle = {angle: copies.get(id(node), node) for angle, node in self.nodes_by_angle.items()}
+        self.extA = copies.get(id(self.extA), self.extA)
+        self.extB = copies.get(id(self.extB), self.extB)
+
+    def _live_copies(self):
+        """
+        @return: copy_chain copies of this chain, and their copies, that still exist
+        """
+        self._copies = [ref for ref in self._copies if ref() is not None]
+        l_copies = [ref() for ref in self._copies]
+        for aux_chain in list(l_copies):
+            l_copies += aux_chain._live_copies()
+        return l_copies
+
+    def _detach_nodes(self):
+        """
+        Prepare the chain nodes to be modified in place. A copy_chain copy copies the nodes it shares with its source
+        chain, and the copies of this chain copy the nodes they share with it. The nodes of a source chain keep their
+        identity, so references held outside the chain (e.g. global nodes lists) see the modification.
+        """
+        if self._shared_nodes is not None:
+            self._replace_nodes(self._shared_nodes)
+            self._shared_nodes = None
+
+        l_copies = self._live_copies()
+        if len(l_copies) > 0:
+            own_nodes = {id(node): node for node in self.l_nodes}
+            for aux_chain in l_copies:
+                aux_chain._replace_nodes([node for node in aux_chain.l_nodes if id(node) in own_nodes])
+
     def get_node_by_angle(self, angle):
-        return get_node_from_list_by_angle(self.l_nodes, angle)
+        return self.nodes_by_angle.get(angle)
 
     def change_id(self, index):
+        self._detach_nodes()
         for dot in self.l_nodes:
             dot.chain_id = index
         self.id = index
@@ -211,21 +301,30 @@ class Chain:
         Compute chain area
         @return: chain area
         """
-        x, y = self.get_nodes_coordinates()
-        #using contour area
-        points = np.array([x, y]).T
-        #convert points to shapely polygon
-        polygon = Polygon(points)
-        #compute area
-        return polygon.area
+        _, y, x, _ = self.get_arrays()
+        #using shoelace formula over the nodes sorted by angle
+        return ring_area(np.vstack((x, y)).T)
 
 
 
 def copy_chain(chain: Chain):
+    """
+    Copy-on-write chain copy. The copy shares the node objects and cached arrays of chain. When the copy modifies its
+    nodes (change_id) it copies them first. When chain modifies its nodes, the copy copies the shared nodes first and
+    chain modifies its own nodes in place, as with a deep copy. Adding nodes to either chain does not affect the
+    other one.
+    @param chain: chain to copy
+    @return: chain copy
+    """
     aux_chain = Chain(chain.id, chain.Nr, chain.center, chain.img_height, chain.img_width, type=chain.type)
-    aux_chain_node_list = [copy_node(node)
-                           for node in chain.l_nodes]
-    aux_chain.add_nodes_list(aux_chain_node_list)
+    aux_chain.l_nodes = list(chain.l_nodes)
+    aux_chain.nodes_by_angle = dict(chain.nodes_by_angle)
+    aux_chain.size = chain.size
+    aux_chain.extA, aux_chain.extB = chain.extA, chain.extB
+    aux_chain.extAind, aux_chain.extBind = chain.extAind, chain.extBind
+    aux_chain._arrays = chain._arrays
+    aux_chain._shared_nodes = list(chain.l_nodes)
+    chain._copies.append(weakref.ref(aux_chain))
 
     return aux_chain
 
@@ -335,11 +434,9 @@ def get_closest_dots_to_angle_on_radial_direction_sorted_by_ascending_distance_t
     """
     node_list_over_ray = []
     for chain in chains_list:
-        try:
-            node = [node for node in chain.l_nodes if node.angle == angle][0]
-        except IndexError:
+        node = chain.get_node_by_angle(angle)
+        if node is None:
             node = get_closest_chain_border_to_angle(chain, angle)
-            pass
 
         if node not in node_list_over_ray:
             node_list_over_ray.append(node)
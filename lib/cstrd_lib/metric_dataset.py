@@ -0,0 +1,287 @@
+"""
+Copyright (c) 2023 Author(s) Henry Marichal (hmarichal93@gmail.com
+
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import argparse
+import traceback
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.image import load_image
+from lib.io import load_json
+from lib.cstrd_lib.metric_influence_area import InfluenceArea, InfluenceMode, threshold_sweep, export_pr_curve
+
+
+class ManifestColumns:
+    name = "name"
+    img = "img_filename"
+    gt = "gt_filename"
+    dt = "dt_filename"
+    cy = "cy"
+    cx = "cx"
+
+
+class ResultColumns:
+    name = "name"
+    precision = "P"
+    recall = "R"
+    fscore = "F"
+    rmse = "RMSE"
+    tp = "TP"
+    fp = "FP"
+    tn = "TN"
+    fn = "FN"
+    error = "error"
+    pooled = "pooled"
+    mean = "mean"
+
+
+_table_columns = [ResultColumns.name, ResultColumns.precision, ResultColumns.recall, ResultColumns.fscore,
+                  ResultColumns.rmse, ResultColumns.tp, ResultColumns.fp, ResultColumns.tn, ResultColumns.fn,
+                  ResultColumns.error]
+
+# evaluation parameters of the current worker process. Set once by _init_worker
+_worker_config = {}
+
+
+def load_manifest(manifest_path):
+    """
+    Load the dataset manifest. It is a csv (or a json list of records) with one row per sample and columns
+    img_filename, gt_filename, dt_filename, cy, cx and optionally name. Relative paths are resolved against the
+    manifest directory.
+    @param manifest_path: manifest filename
+    @return: list of sample dictionaries
+    """
+    manifest_path = Path(manifest_path)
+    if manifest_path.suffix == ".json":
+        df = pd.DataFrame(load_json(manifest_path))
+    else:
+        df = pd.read_csv(manifest_path)
+
+    missing = [c for c in [ManifestColumns.img, ManifestColumns.gt, ManifestColumns.dt, ManifestColumns.cy,
+                           ManifestColumns.cx] if c not in df.columns]
+    if len(missing) > 0:
+        raise ValueError(f"Manifest {manifest_path} is missing columns {missing}")
+
+    root = manifest_path.parent
+    l_samples = []
+    for idx, row in df.iterrows():
+        sample = {}
+        for column in [ManifestColumns.img, ManifestColumns.gt, ManifestColumns.dt]:
+            path = Path(row[column])
+            sample[column] = str(path if path.is_absolute() else root / path)
+        sample[ManifestColumns.cy] = int(row[ManifestColumns.cy])
+        sample[ManifestColumns.cx] = int(row[ManifestColumns.cx])
+        name = row.get(ManifestColumns.name) if ManifestColumns.name in df.columns else None
+        sample[ManifestColumns.name] = str(name) if isinstance(name, str) and len(name) > 0 else \
+            f"{idx:04d}_{Path(sample[ManifestColumns.dt]).stem}"
+        l_samples.append(sample)
+
+    return l_samples
+
+
+@lru_cache(maxsize=4)
+def _load_image_cached(img_filename):
+    # samples of the same disk (several detectors or settings over one image) reuse the decoded image.
+    # Ray bundles are shared the same way by get_ray_bundle
+    return load_image(img_filename)
+
+
+def _init_worker(config):
+    _worker_config.clear()
+    _worker_config.update(config)
+
+
+def evaluate_sample(sample):
+    """
+    Evaluate one manifest sample with the worker configuration. Errors are reported in the result instead of being
+    raised so that a single broken sample does not stop the dataset evaluation.
+    @param sample: manifest sample dictionary
+    @return: per sample result dictionary
+    """
+    config = _worker_config
+    name = sample[ManifestColumns.name]
+    result = {ResultColumns.name: name, ResultColumns.error: None, "rmse_per_ring": np.array([]),
+              "raw_accuracy_percentage": np.array([]), "n_gt": 0}
+    try:
+        # pixels are only needed to render the plots
+        img = _load_image_cached(sample[ManifestColumns.img]) if config["plot"] else None
+        if config["plot"] and img is None:
+            raise FileNotFoundError(sample[ManifestColumns.img])
+        metrics = InfluenceArea(sample[ManifestColumns.gt], sample[ManifestColumns.dt], sample[ManifestColumns.img],
+                                Path(config["output_dir"]) / name, config["threshold"], sample[ManifestColumns.cy],
+                                sample[ManifestColumns.cx], Nr=config["Nr"], mode=config["mode"], img=img)
+        TP, FP, TN, FN = metrics.compute_indicators(plot=False)
+        RMSE = metrics.compute_rmse_global(plot=False) if TP > 0 else np.nan
+        if config["plot"]:
+            metrics.generate_radial_error_heat_map(plot=False)
+            metrics.render_plots()
+
+    except Exception as e:
+        # the sample is reported as errored in the results table. The traceback is printed by the worker
+        print(f"Error evaluating sample {name}:\n{traceback.format_exc()}", flush=True)
+        result[ResultColumns.error] = repr(e)
+        return result
+
+    result.update({
+        ResultColumns.precision: metrics.precision(TP, FP, TN, FN),
+        ResultColumns.recall: metrics.recall(TP, FP, TN, FN),
+        ResultColumns.fscore: metrics.fscore(TP, FP, TN, FN),
+        ResultColumns.rmse: RMSE,
+        ResultColumns.tp: TP, ResultColumns.fp: FP, ResultColumns.tn: TN, ResultColumns.fn: FN,
+        "rmse_per_ring": np.asarray(metrics.rmse_per_ring if metrics.rmse_per_ring is not None else []),
+        "raw_accuracy_percentage": np.asarray(metrics.raw_accuracy_percentage),
+        "n_gt": len(metrics.gt_poly)
+    })
+    return result
+
+
+def aggregate_results(l_results):
+    """
+    Build the results table: one row per sample, a pooled row and a mean row. Pooled P/R/F are computed from the
+    TP/FP/FN summed over the dataset and pooled RMSE averages every assigned ring of the dataset. Mean row is the
+    average of the per sample values.
+    @param l_results: evaluate_sample results
+    @return: results dataframe
+    """
+    l_rows = [{k: v for k, v in result.items() if k in _table_columns} for result in l_results]
+    df = pd.DataFrame(l_rows, columns=_table_columns)
+    valid = df[df[ResultColumns.error].isna()]
+
+    TP = valid[ResultColumns.tp].sum()
+    FP = valid[ResultColumns.fp].sum()
+    FN = valid[ResultColumns.fn].sum()
+    P = TP / (TP + FP) if TP + FP > 0 else 0
+    R = TP / (TP + FN) if TP + FN > 0 else 0
+    F = 2 * P * R / (P + R) if P + R > 0 else 0
+    rmse_per_ring = np.concatenate([result["rmse_per_ring"] for result in l_results] + [np.array([])])
+    rmse_per_ring = rmse_per_ring[~np.isnan(rmse_per_ring)]
+    RMSE = rmse_per_ring.mean() if rmse_per_ring.shape[0] > 0 else np.nan
+
+    pooled = {ResultColumns.name: ResultColumns.pooled, ResultColumns.precision: P, ResultColumns.recall: R,
+              ResultColumns.fscore: F, ResultColumns.rmse: RMSE, ResultColumns.tp: TP, ResultColumns.fp: FP,
+              ResultColumns.tn: valid[ResultColumns.tn].sum(), ResultColumns.fn: FN}
+    mean = {ResultColumns.name: ResultColumns.mean}
+    for column in [ResultColumns.precision, ResultColumns.recall, ResultColumns.fscore, ResultColumns.rmse]:
+        mean[column] = valid[column].astype(float).mean()
+
+    return pd.concat([df, pd.DataFrame([pooled, mean])], ignore_index=True)
+
+
+def pooled_threshold_sweep(l_results, thresholds):
+    """
+    Dataset level precision-recall sweep. Per sample counts are additive, so the raw detection accuracies of every
+    sample are pooled and swept at once. Errored samples have neither detections nor ground truth rings, so the sweep
+    only covers the evaluated samples. It is then partial: n_errors is not 0.
+    @param l_results: evaluate_sample results
+    @param thresholds: array of thresholds. Between 0 and 1.
+    @return: threshold_sweep dictionary, plus the number of samples (n_samples) and of errored samples (n_errors)
+    """
+    raw_accuracy = np.concatenate([result["raw_accuracy_percentage"] for result in l_results] + [np.array([])])
+    n_gt = sum([result["n_gt"] for result in l_results])
+    sweep = threshold_sweep(raw_accuracy, n_gt, thresholds)
+    sweep.update(n_samples=len(l_results),
+                 n_errors=sum([result[ResultColumns.error] is not None for result in l_results]))
+    return sweep
+
+
+def evaluate_dataset(l_samples, output_dir, threshold, Nr=360, mode=InfluenceMode.raster, n_jobs=None, plot=False,
+                     sweep_thresholds=None):
+    """
+    Evaluate the influence area metric over a dataset using a process pool.
+    Samples are dispatched grouped by image, so samples of the same disk usually land on the same worker and share
+    the loaded image and the ray bundle.
+    @param l_samples: manifest samples. See load_manifest
+    @param output_dir: output directory. Results table is saved as metrics.csv and figures (if plot) under a
+    subdirectory per sample
+    @param threshold: threshold to consider a detection ring as false positive. Between 0 and 1.
+    @param Nr: number of rays
+    @param mode: influence area domain. Raster (image sized influence matrix) or polar (band contours, filled around
+    the detection samples)
+    @param n_jobs: number of worker processes. By default, every core is used. If 1, samples are evaluated in the
+    current process
+    @param plot: render per sample figures
+    @param sweep_thresholds: optional array of thresholds. If given, the pooled precision-recall curve is exported to
+    output_dir/pr_curve.csv and output_dir/pr_curve.png
+    @return: results dataframe
+    """
+    if threshold > 1:
+        raise ValueError("The threshold must be between 0 and 1")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    config = dict(output_dir=str(output_dir), threshold=threshold, Nr=Nr, mode=mode, plot=plot)
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    n_jobs = max(1, min(n_jobs, len(l_samples)))
+
+    order = sorted(range(len(l_samples)), key=lambda idx: (l_samples[idx][ManifestColumns.img],
+                                                           l_samples[idx][ManifestColumns.cy],
+                                                           l_samples[idx][ManifestColumns.cx]))
+    l_sorted = [l_samples[idx] for idx in order]
+    if n_jobs == 1:
+        _init_worker(config)
+        l_sorted_results = [evaluate_sample(sample) for sample in l_sorted]
+    else:
+        chunksize = max(1, len(l_sorted) // (4 * n_jobs))
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(config,)) as executor:
+            l_sorted_results = list(executor.map(evaluate_sample, l_sorted, chunksize=chunksize))
+
+    # restore manifest order
+    l_results = [None] * len(l_samples)
+    for idx, result in zip(order, l_sorted_results):
+        l_results[idx] = result
+
+    df = aggregate_results(l_results)
+    df.to_csv(output_dir / "metrics.csv", index=False)
+    if sweep_thresholds is not None:
+        sweep = pooled_threshold_sweep(l_results, sweep_thresholds)
+        if sweep["n_errors"] > 0:
+            print(f"Partial precision-recall curve: {sweep['n_errors']} of {sweep['n_samples']} samples could not be "
+                  f"evaluated and are not counted")
+        export_pr_curve(sweep, output_dir)
+    return df
+
+
+def main(manifest, output_dir, threshold, Nr=360, mode=InfluenceMode.raster, n_jobs=None, plot=False,
+         sweep_thresholds=None):
+    l_samples = load_manifest(manifest)
+    df = evaluate_dataset(l_samples, output_dir, threshold, Nr=Nr, mode=mode, n_jobs=n_jobs, plot=plot,
+                          sweep_thresholds=sweep_thresholds)
+    pooled = df[df[ResultColumns.name] == ResultColumns.pooled].iloc[0]
+    n_errors = df[ResultColumns.error].notna().sum()
+    print(f"{len(l_samples)} samples ({n_errors} errors) P={pooled[ResultColumns.precision]:.2f} "
+          f"R={pooled[ResultColumns.recall]:.2f} F={pooled[ResultColumns.fscore]:.2f} "
+          f"RMSE={pooled[ResultColumns.rmse]:.2f}")
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--manifest", type=str, required=True,
+                        help="csv or json with columns img_filename, gt_filename, dt_filename, cy, cx and "
+                             "optionally name")
+    parser.add_argument("--output_dir", type=str, required=True, help="output directory for the results")
+    parser.add_argument("--th", type=float, required=True,
+                        help="threshold to consider a detection as valid. Between 0 and 1")
+    parser.add_argument("--nr", type=int, default=360, help="number of rays")
+    parser.add_argument("--mode", type=str, default=InfluenceMode.raster,
+                        choices=[InfluenceMode.raster, InfluenceMode.polar],
+                        help="influence area domain. Polar mode does not allocate image sized masks")
+    parser.add_argument("--jobs", type=int, default=None, help="number of worker processes. Default: every core")
+    parser.add_argument("--plot", action="store_true", help="render per sample figures")
+    parser.add_argument("--sweep", type=int, default=None,
+                        help="export the pooled precision-recall curve for this number of thresholds between 0 and 1")
+
+    args = parser.parse_args()
+    sweep_thresholds = np.linspace(0, 1, args.sweep) if args.sweep is not None else None
+    main(args.manifest, args.output_dir, args.th, Nr=args.nr, mode=args.mode, n_jobs=args.jobs, plot=args.plot,
+         sweep_thresholds=sweep_thresholds)
@@ -12,45 +12,61 @@ import argparse
 from shapely.geometry import Polygon, LineString
 from pathlib import Path
 import cv2 as cv
-import matplotlib.pyplot as plt
 
-from lib.image import load_image, load_json
-from lib.cstrd_lib.sampling import build_rays, compute_intersection, draw_ray_curve_and_intersections
+from lib.image import load_image, get_image_info
+from lib.plots import PlotJob, render_plot, render_plots as render_plots_jobs
+from lib.labelme_cache import load_labelme_arrays
+from lib.cstrd_lib.sampling import get_ray_bundle, RingSamples, draw_ray_curve_and_intersections
 import lib.cstrd_lib.chain as ch
 
 FP_ID = -1
 
 
-class Polygon_node(Polygon):
-    def __init__(self, node_list):
-        self.angles = [node.angle for node in node_list]
-        self.node_list = node_list
-        super().__init__([[node.y, node.x] for node in node_list])
+class InfluenceMode:
+    raster = "raster"
+    polar = "polar"
 
 
 class InfluenceArea:
-    def __init__(self, gt_file, dt_file, img_filename, output_dir, threshold, cy, cx, Nr=360):
+    def __init__(self, gt_file, dt_file, img_filename, output_dir, threshold, cy, cx, Nr=360,
+                 mode=InfluenceMode.raster, img=None):
         # 1.0 generate output directory
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         # 2.0 set parameters
         self.threshold = threshold
         self.Nr = Nr
+        self.mode = mode
         self.center = [cy, cx]
-        # 3.0 load image
-        self.img = load_image(img_filename)
+        # 3.0 image size. Pixels are only decoded when plotting (see img). An already loaded image can be shared
+        # between evaluations of the same disk
+        self.img_filename = img_filename
+        self._img = img
+        height, width = get_image_info(img_filename)[:2] if img is None else img.shape[:2]
         # 4.0 sampling detection and groud truth rings by Nr rays.
-        height, width, _ = self.img.shape
-        l_rays = build_rays(self.Nr, height, width, self.center)
+        l_rays = get_ray_bundle(self.Nr, height, width, self.center)
+        self.image_shape = (height, width)
+        self.directions = l_rays.directions
         self.dt_poly = self.get_sampled_polygon_rings(dt_file, l_rays, self.center)
         self.dt_poly.sort(key=lambda x: x.area)
         self.gt_poly = self.get_sampled_polygon_rings(gt_file, l_rays, self.center)
         self.gt_poly.sort(key=lambda x: x.area)
-        # 5.0 draw rays and rings
-
-
-
-
+        # 5.0 results. They are filled by compute_indicators, compute_rmse_global and generate_radial_error_heat_map
+        self.rmse_matrix = None
+        self.influence = None
+        self.indicators = None
+        self.dt_and_gt_assignation = None
+        self.accuracy_percentage = None
+        self.raw_accuracy_percentage = None
+        self.rmse_per_ring = None
+        self.rmse = None
+        self.color_map = None
+
+    @property
+    def img(self):
+        if self._img is None:
+            self._img = load_image(self.img_filename)
+        return self._img
 
     def draw_ray_and_dt_and_gt(self, rays_list, l_gt_poly, l_dt_poly, img_draw, filename):
         pass
@@ -74,10 +90,8 @@ class InfluenceArea:
     @staticmethod
     def load_ring_stimation(path):
         try:
-            json_content = load_json(path)
-            l_rings = []
-            for ring in json_content['shapes']:
-                l_rings.append(Polygon(np.array(ring['points'])[:, [1, 0]].tolist()))
+            arrays = load_labelme_arrays(path)
+            l_rings = [Polygon(arrays.get_shape_points(idx)) for idx in range(len(arrays))]
 
         except FileNotFoundError:
             l_rings = []
@@ -91,63 +105,31 @@ class InfluenceArea:
 
         return poly_list
 
-    def _add_poly_to_img(self, img, poly, color, thickness=1):
-        isClosed = True
-        y, x = poly.exterior.coords.xy
-        pts = np.vstack((x, y)).T.astype(np.int32)
-        pts = pts.reshape((-1, 1, 2))
-
-        return cv.polylines(img, [pts], isClosed, color, thickness)
-
     @staticmethod
     def _sampling_poly(poly, cy, cx, l_rays):
-        l_curve_nodes = compute_intersection(l_rays, poly, -1, [cy, cx])
-        if l_curve_nodes is None:
+        sampled_poly = RingSamples.from_curve(l_rays, poly, [cy, cx])
+        if len(sampled_poly) < 3:
             return None
-        l_curve_nodes.sort(key=lambda x: x.angle)
-
-        return Polygon_node(l_curve_nodes)
-
-    def _plot_gt_and_dt_polys(self, img, gt, dt, n=1, title=None):
-        img_aux = img.copy()
-        # gt
-        for poly in gt:
-            img_aux = self._add_poly_to_img(img_aux, poly, color=(0, 255, 0), thickness=n)
-
-        # dt
-        for poly in dt:
-            img_aux = self._add_poly_to_img(img_aux, poly, color=(255, 0, 0), thickness=n)
-
-        plt.figure(figsize=(10, 10));
-        plt.imshow(img_aux);
-        plt.axis('off');
-        if title is not None:
-            plt.title(title)
-        plt.savefig(f'{self.output_dir}/dt_and_gt.png')
-        # plt.show();
-        plt.close()
-
-
-    def get_x_and_y_coordinates(self, poly: Polygon_node):
-        # if type(poly) is Polygon:
-        #     y, x  = poly.exterior.coords.xy
-        #     return x, y
-        x = [int(node.x) for node in poly.node_list]
-        y = [int(node.y) for node in poly.node_list]
-        return x, y
+
+        return sampled_poly
+
+    def get_x_and_y_coordinates(self, poly: RingSamples):
+        y, x = poly.get_coordinates()
+        return x.astype(int), y.astype(int)
+
     def extract_poly_coordinates(self, poly):
         x, y = self.get_x_and_y_coordinates(poly)
         pts = np.vstack((y, x)).T.astype(np.int32)
         return pts
 
-    def generate_radial_error_heat_map(self):
+    def generate_radial_error_heat_map(self, plot=True):
         """
         Generate a heat map of radial difference error between dt and gt
+        @param plot: if True, save the heat map figure
         @return:
         """
         self.color_map = np.zeros((len(self.gt_poly), self.Nr)) + np.nan
         for idx, dt in enumerate(self.dt_poly):
-            dt_nodes = dt.node_list#self.extract_poly_coordinates(dt)
             if len(self.dt_and_gt_assignation) - 1 < idx:
                 continue
 
@@ -155,18 +137,12 @@ class InfluenceArea:
             if gt_idx == FP_ID:
                 continue
 
-            gt_nodes = self.gt_poly[gt_idx].node_list#.extract_poly_coordinates(self.gt_poly[gt_idx])
-
-            for ray_direction_i in range(self.Nr):
-                dti_node = ch.get_node_from_list_by_angle(dt_nodes, ray_direction_i)#self.get_dot_by_ray_direction_index(ray_direction_i, dt_dots)
-                gti_node =ch.get_node_from_list_by_angle(gt_nodes, ray_direction_i)# self.get_dot_by_ray_direction_index(ray_direction_i, gt_dots)
-                radial_distance_dti = dti_node.radial_distance#self.compute_radial_distance(dti_dot)
-                radial_distance_gti = gti_node.radial_distance#self.compute_radial_distance(gti_dot)
-                radial_difference = radial_distance_dti - radial_distance_gti
-
-                self.color_map[gt_idx, int(ray_direction_i)] = radial_difference
+            gt = self.gt_poly[gt_idx]
+            radial_difference = dt.radii - gt.radii
+            self.color_map[gt_idx] = np.where(dt.mask & gt.mask, radial_difference, np.nan)
 
-        self.plot_color_map(self.color_map)
+        if plot:
+            self.plot_color_map(self.color_map)
         return 0
 
     def compute_rmse_between_dt_and_gt(self, dt_poly, gt_poly):
@@ -174,90 +150,105 @@ class InfluenceArea:
         Compute the RMSE between the dt and gt polygons. Each polygon has Nr points.
         @param dt_poly: detection ring polygon
         @param gt_poly: ground truth ring polygon
-        @return: rmse error
+        @return: rmse error. nan if no ray samples both polygons, as in compute_rmse_matrix
         """
-        error = []
-        l_dt_dot = self.extract_poly_coordinates(dt_poly)
-        l_gt_dot = self.extract_poly_coordinates(gt_poly)
-        for ray_direction_idx in range(self.Nr):
-            dt_dot = self.get_dot_by_ray_direction_index(ray_direction_idx, l_dt_dot)
-            gt_dot = self.get_dot_by_ray_direction_index(ray_direction_idx, l_gt_dot)
-            radial_distance_dt = self.compute_radial_distance(dt_dot)
-            radial_distance_gt = self.compute_radial_distance(gt_dot)
-            radial_difference = radial_distance_dt - radial_distance_gt
-            error.append(radial_difference ** 2)
+        mask = dt_poly.mask & gt_poly.mask
+        if not mask.any():
+            return np.nan
+        radial_difference = dt_poly.radii[mask].astype(float) - gt_poly.radii[mask]
+        return np.sqrt(np.mean(radial_difference ** 2))
 
-        return np.sqrt(np.mean(error))
+    @staticmethod
+    def stack_radii(l_poly, Nr):
+        """
+        Stack the radial distances of the sampled rings into a (len(l_poly), Nr) matrix. Rays that miss a ring are nan.
+        @param l_poly: sampled rings list
+        @param Nr: number of rays
+        @return: radii matrix
+        """
+        radii = np.full((len(l_poly), Nr), np.nan)
+        for idx, poly in enumerate(l_poly):
+            radii[idx] = np.where(poly.mask, poly.radii, np.nan)
+        return radii
+
+    def compute_rmse_matrix(self):
+        """
+        Compute the RMSE between every detection and every ground truth ring in a single broadcast. Only rays sampled in
+        both rings are taken into account.
+        @return: (D, G) rmse matrix. Pairs without common rays are nan.
+        """
+        dt_radii = self.stack_radii(self.dt_poly, self.Nr)
+        gt_radii = self.stack_radii(self.gt_poly, self.Nr)
+        dt_mask = (~np.isnan(dt_radii)).astype(float)
+        gt_mask = (~np.isnan(gt_radii)).astype(float)
+        dt_radii = np.nan_to_num(dt_radii)
+        gt_radii = np.nan_to_num(gt_radii)
+        # sum_k (dt_k - gt_k)^2 = sum_k dt_k^2 - 2 dt_k gt_k + gt_k^2, over the rays valid in both rings
+        squared_error = ((dt_radii ** 2) @ gt_mask.T - 2 * dt_radii @ gt_radii.T + dt_mask @ (gt_radii ** 2).T)
+        n_rays = dt_mask @ gt_mask.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rmse_matrix = np.sqrt(np.maximum(squared_error, 0) / n_rays)
+        rmse_matrix[n_rays == 0] = np.nan
+        return rmse_matrix
 
     def plot_color_map(self, polar_heat_map):
-        # polar
-        # https://stackoverflow.com/questions/36513312/polar-heatmaps-in-python
-
-        rad = np.linspace(0, len(self.gt_poly), len(self.gt_poly) + 1)
-        theta = np.linspace(0, 2 * np.pi, self.Nr)
-        th, r = np.meshgrid(theta, rad)
-
-        cmaps = ['Spectral']
-        for cmap_label in cmaps:
-            fig = plt.figure(figsize=(10, 10))
-            ax = fig.add_subplot(111, projection='polar')
-            pcm = ax.pcolormesh(th, r, polar_heat_map, cmap=plt.get_cmap(cmap_label))
-            ax.set_yticklabels([])
-            ax.set_xticklabels([])
-            ax.set_theta_zero_location('S')
-            plt.title(f'Heat map radial error between dt and gt')
-            fig.colorbar(pcm, ax=ax, orientation="vertical")
-            fig.savefig(f"{self.output_dir}/heat_map_{cmap_label}.png")
-
-            plt.close()
+        plot_color_map(polar_heat_map, self.Nr, self.output_dir)
 
     def compute_radial_distance(self, pt):
         return ch.euclidean_distance([pt[1], pt[0]], self.center)
 
-    def compute_rmse_global(self):
-        l_rmse = [None] * len(self.gt_poly)
-        for idx, dt in enumerate(self.dt_poly):
-            if len(self.dt_and_gt_assignation) - 1 < idx:
-                continue
-
-            gt_idx = self.dt_and_gt_assignation[idx]
-            if gt_idx == FP_ID:
-                continue
-
-            gt = self.gt_poly[gt_idx]
-            rmse = self.compute_rmse_between_dt_and_gt(dt, gt)
-            l_rmse[gt_idx] = rmse
-
-        mean_rmse = np.mean([rmse for rmse in l_rmse if rmse is not None])
-        l_rmse = np.array(l_rmse)
-        self.plot_rmse_per_ring(np.where(l_rmse == None, 0, l_rmse), mean_rmse)
+    def compute_rmse_global(self, plot=True):
+        if self.rmse_matrix is None:
+            self.rmse_matrix = self.compute_rmse_matrix()
+
+        l_rmse = np.full(len(self.gt_poly), np.nan)
+        dt_and_gt_assignation = np.array(self.dt_and_gt_assignation, dtype=int)
+        dt_idx = np.where(dt_and_gt_assignation != FP_ID)[0]
+        gt_idx = dt_and_gt_assignation[dt_idx]
+        l_rmse[gt_idx] = self.rmse_matrix[dt_idx, gt_idx]
+
+        valid_rmse = l_rmse[~np.isnan(l_rmse)]
+        mean_rmse = np.mean(valid_rmse) if valid_rmse.size > 0 else np.nan
+        self.rmse_per_ring = l_rmse
+        self.rmse = mean_rmse
+        if plot:
+            self.plot_rmse_per_ring(np.nan_to_num(l_rmse), mean_rmse)
         return mean_rmse
 
     def plot_rmse_per_ring(self, l_rmse, overal_rmse):
-        plt.figure()
-        plt.bar(np.arange(0, len(l_rmse)), l_rmse)
-        plt.title(f"RMSE global={overal_rmse:.3f}")
-        plt.xlabel('Number Ring')
-        plt.ylabel('RMSE (per gt)')
-        plt.grid(True)
-        plt.savefig(f"{self.output_dir}/rmse.png")
-        # plt.show()
-        plt.close()
+        plot_rmse_per_ring(l_rmse, overal_rmse, self.output_dir)
 
     def get_dot_by_ray_direction_index(self, alpha, pts):
         return pts[int(alpha)].reshape(1, 2)[0]
 
     def mean_interpolation(self, dot1, dot2):
         """
-        Compute mean interpolation between two dots
+        Compute mean interpolation between two dots. Dots can be single pixels or (Nr, 2) arrays of pixels.
         @param dot1: pixel dot 1
         @param dot2: pixel dot 2
         @return: mean pixel dot
         """
-        return (0.5 * (dot1 + dot2)).astype(int).tolist()
+        return (0.5 * (dot1 + dot2)).astype(int)
 
     def mirror_interpolation(self, dot1, dot2):
-        return (dot1 + (dot1 - dot2)).astype(int).tolist()
+        """
+        Compute mirror interpolation of dot2 with respect to dot1. Dots can be single pixels or (Nr, 2) arrays of pixels.
+        @param dot1: pixel dot 1
+        @param dot2: pixel dot 2
+        @return: mirrored pixel dot
+        """
+        return (dot1 + (dot1 - dot2)).astype(int)
+
+    @staticmethod
+    def get_ray_pixels(poly: RingSamples):
+        """
+        Return the (Nr, 2) array of integer (y, x) pixels sampled by each ray. Rays that miss the ring are set to 0.
+        @param poly: sampled ring
+        @return: pixels array
+        """
+        pixels = np.column_stack((poly.y, poly.x))
+        pixels[~poly.mask] = 0
+        return pixels.astype(int)
 
     def generate_new_poly(self, pol1, pol2, type_interpolation='mean'):
         """
@@ -271,33 +262,25 @@ class InfluenceArea:
         @param type_interpolation: mean or mirror
         @return: new polygon
         """
-        pol1_dots = self.extract_poly_coordinates(pol1)
-        pol2_dots = self.extract_poly_coordinates(pol2)
-        dots_new_poly = []
-        for ray_direction_idx in range(self.Nr):
-            angle_dot_1 = self.get_dot_by_ray_direction_index(ray_direction_idx, pol1_dots)
-            angle_dot_2 = self.get_dot_by_ray_direction_index(ray_direction_idx, pol2_dots)
-            new_dot = self.mean_interpolation(angle_dot_1, angle_dot_2) if type_interpolation in 'mean' else \
-                self.mirror_interpolation(angle_dot_1, angle_dot_2)
-            # dot is an array [x, y]. We neet to convert it to node object
-            new_node = ch.Node(x = int(new_dot[1]), y = int(new_dot[0]), angle=ray_direction_idx,
-                            radial_distance = self.compute_radial_distance(new_dot), chain_id = -1)
-            dots_new_poly.append(new_node)
-        return Polygon_node(dots_new_poly)
-
-    def _build_influence_area(self, img, l_gt_poly):
+        pol1_dots = self.get_ray_pixels(pol1)
+        pol2_dots = self.get_ray_pixels(pol2)
+        new_dots = self.mean_interpolation(pol1_dots, pol2_dots) if type_interpolation in 'mean' else \
+            self.mirror_interpolation(pol1_dots, pol2_dots)
+        cy, cx = self.center
+        radii = np.hypot(new_dots[:, 0] - cy, new_dots[:, 1] - cx)
+        return RingSamples(pol1.angles, new_dots[:, 0], new_dots[:, 1], radii, mask=pol1.mask & pol2.mask)
+
+    def _build_influence_bands(self, l_gt_poly):
         """
-        Compute influence matrix. Each pixel has a value that indicates the gt_poly that influences it the most.
-        @param img: image matrix
+        Compute the contours that bound the influence area of each gt_poly. The inner contour Cm is the mean between
+        gt_i and gt_{i-1} (None for the first ring) and the outer one CM the mean between gt_i and gt_{i+1}, or the
+        mirror of Cm around the last ring. Contours are integer (y, x) pixels as filled by cv.fillPoly.
         @param l_gt_poly: ground truth polygon list
-        @return: influence matrix
+        @return: list of (inner contour, outer contour), one per gt_poly
         """
-        influence_matrix = np.zeros((img.shape[1], img.shape[0])) - 1
         l_gt_poly.sort(key=lambda x: x.area)
-
-        M, N, _ = self.img.shape
-        i = 0
-        for gt_i in l_gt_poly:
+        bands = []
+        for i, gt_i in enumerate(l_gt_poly):
             gt_i_plus_1 = l_gt_poly[i + 1] if i < len(l_gt_poly) - 1 else None
             gt_i_minus_1 = l_gt_poly[i - 1] if i > 0 else None
 
@@ -305,26 +288,54 @@ class InfluenceArea:
             CM = self.generate_new_poly(gt_i, gt_i_plus_1) if gt_i_plus_1 is not None else \
                 self.generate_new_poly(gt_i, Cm, type_interpolation='mirror')
 
-            if Cm is None:
-                # 1. First ring
-                contours = self.extract_poly_coordinates(CM)
-                mask = np.zeros((N, M))
-                cv.fillPoly(mask, pts=[contours], color=(255))
+            inner = self.extract_poly_coordinates(Cm) if Cm is not None else None
+            bands.append((inner, self.extract_poly_coordinates(CM)))
 
-            else:
-                contours = self.extract_poly_coordinates(CM)
-                mask_M = np.zeros((N, M))
-                cv.fillPoly(mask_M, pts=[contours], color=(255))
+        return bands
 
-                contours = self.extract_poly_coordinates(Cm)
-                mask_m = np.zeros((N, M))
-                cv.fillPoly(mask_m, pts=[contours], color=(255))
-                mask = mask_M - mask_m
+    def _build_influence_area(self, image_shape, l_gt_poly):
+        """
+        Compute influence matrix. Each pixel has a value that indicates the gt_poly that influences it the most.
+        @param image_shape: image height and width
+        @param l_gt_poly: ground truth polygon list
+        @return: influence matrix
+        """
+        return bands_influence_matrix(self._build_influence_bands(l_gt_poly), image_shape)
 
-            influence_matrix[mask > 0] = i
-            i += 1
+    def _build_polar_influence_area(self, l_gt_poly):
+        """
+        Compute the influence area without the image sized influence matrix. Only the band contours of each gt_poly are
+        kept, and they are filled when detection samples are labelled (see _get_influence_labels), so the result is the
+        same as in raster mode.
+        @param l_gt_poly: ground truth polygon list
+        @return: list of (inner contour, outer contour), one per gt_poly
+        """
+        return self._build_influence_bands(l_gt_poly)
 
-        return influence_matrix
+    def _get_influence_labels(self, influence, l_poly):
+        """
+        Return the gt ring index that influences each detection sample, -1 when the sample is outside every influence
+        area. When bands overlap, the outer ring wins.
+        @param influence: influence matrix or, in polar mode, band contours
+        @param l_poly: sampled detection rings
+        @return: list of labels arrays, one per detection ring
+        """
+        l_coordinates = [self.get_x_and_y_coordinates(poly) for poly in l_poly]
+        if self.mode != InfluenceMode.polar:
+            return [influence[x, y].astype(int) for x, y in l_coordinates]
+
+        # every band is filled once, on a window around its outer contour, for the samples of all detection rings
+        x = np.concatenate([x for x, _ in l_coordinates]).astype(int) if l_coordinates else np.zeros(0, dtype=int)
+        y = np.concatenate([y for _, y in l_coordinates]).astype(int) if l_coordinates else np.zeros(0, dtype=int)
+        canvas_shape = (self.image_shape[1], self.image_shape[0])
+        labels = np.full(x.shape[0], -1, dtype=int)
+        for i, (inner, outer) in enumerate(influence):
+            in_band = contour_contains(outer, x, y, canvas_shape)
+            if inner is not None:
+                in_band &= ~contour_contains(inner, x, y, canvas_shape)
+            labels[in_band] = i
+
+        return np.split(labels, np.cumsum([len(x) for x, _ in l_coordinates])[:-1])
 
     def true_positive(self):
         return np.where(np.array(self.dt_and_gt_assignation) > -1)[0].shape[0]
@@ -356,52 +367,48 @@ class InfluenceArea:
         Assign each detection polygon to a ground truth polygon. The assignment is done by computing the number of pixels
         inside the ground truth influence area. The detection polygon is assigned to the ground truth polygon with lower
         RMSE error
-        @param influence_matrix: ground truth influcen matrix
+        @param influence_matrix: ground truth influcen matrix, or band contours in polar mode
         @param l_dt_poly: detection polygon list
         @return: vector detection assignation and percentage of detection point inside the ground truth influence area.
+        Both follow the l_dt_poly order and hold FP_ID for the detections that are not assigned, including those outside
+        every influence area.
         """
         threshold = self.threshold
         dt_and_gt_assignation = []
         accuracy_percentage = []
         l_dt_poly.sort(key=lambda x: x.area)
+        # rmse between each detection and every ground truth, rows follow the l_dt_poly order
+        self.rmse_matrix = self.compute_rmse_matrix()
+        rmse_matrix = np.where(np.isnan(self.rmse_matrix), np.inf, self.rmse_matrix)
 
-        for poly in l_dt_poly:
-            # 1.0 extract detection poly coordinates
-            x, y = self.get_x_and_y_coordinates(poly)
-            #y, x = poly.exterior.coords.xy
-            #x = np.array(x).astype(int)
-            #y = np.array(y).astype(int)
-
-            # 2.0 extract influence matrix values for detection poly coordinates
-            gts = influence_matrix[x, y].astype(int)
+        l_gts = self._get_influence_labels(influence_matrix, l_dt_poly)
+        for dt_idx, poly in enumerate(l_dt_poly):
+            # 1.0 - 2.0 extract influence values for detection poly coordinates
+            gts = l_gts[dt_idx]
 
             # 3.0 compute the number of detection pixels that are influenced by each gt_poly
             mask_no_background = np.where(gts >= 0)[0]
-            counts = np.bincount(gts[mask_no_background])
+            counts = np.bincount(gts[mask_no_background], minlength=len(self.gt_poly))
 
-            if len(counts) == 0:
+            if counts.sum() == 0:
                 # 3.1 no gt_poly influences the detection poly
                 dt_and_gt_assignation.append(FP_ID)
+                accuracy_percentage.append(FP_ID)
                 continue
 
-            # 4.0 Find the gt_poly that influences the most pixels of the detection poly
-            error_vector_between_detection_and_gt_lists = [self.compute_rmse_between_dt_and_gt(poly, gt_poly) for
-                                                           gt_poly in self.gt_poly]
-            gt_label = np.argmin(error_vector_between_detection_and_gt_lists)
+            # 4.0 Find the gt_poly with the lowest rmse to the detection poly
+            gt_label = int(np.argmin(rmse_matrix[dt_idx]))
             if gt_label in dt_and_gt_assignation:
                 # 4.1 the gt_poly has already been assigned to another detection poly.
                 # Check if the current detection poly has a lower rmse error
-                rmse_current = self.compute_rmse_between_dt_and_gt(poly, self.gt_poly[gt_label])
-                id_dt_former = np.where(dt_and_gt_assignation == gt_label)[0][0]
-                rmse_former = self.compute_rmse_between_dt_and_gt(self.dt_poly[id_dt_former], self.gt_poly[gt_label])
+                rmse_current = rmse_matrix[dt_idx, gt_label]
+                id_dt_former = dt_and_gt_assignation.index(gt_label)
+                rmse_former = rmse_matrix[id_dt_former, gt_label]
                 if rmse_current < rmse_former:
                     # 4.1.1 the current detection poly has a lower rmse error than the former one. Change former assignation
                     # to be a false positive
                     dt_and_gt_assignation[id_dt_former] = FP_ID
-                    try:
-                        accuracy_percentage[id_dt_former] = FP_ID
-                    except Exception as e:
-                        continue
+                    accuracy_percentage[id_dt_former] = FP_ID
                 else:
                     # 4.1.2 the current detection poly has a higher rmse error than the former one.
                     # Assign it as a false positive
@@ -414,6 +421,9 @@ class InfluenceArea:
             # 6.0 compute the accuracy percentage of the detection poly.
             accuracy_percentage.append(counts[gt_label] / self.Nr)
 
+        # accuracy before thresholding. Enough to recompute the indicators for any other threshold
+        self.raw_accuracy_percentage = np.array(accuracy_percentage, dtype=float)
+
         # 7.0 assign as false positive the detection polys that have an accuracy percentage lower than the threshold
         no_asigned_idx = np.where(np.array(accuracy_percentage) < threshold)[0].astype(int)
         dt_and_gt_assignation = np.array(dt_and_gt_assignation)
@@ -425,86 +435,415 @@ class InfluenceArea:
 
         return dt_and_gt_assignation, accuracy_percentage
 
-    def _plot_assignation_between_gt_and_dt(self):
-        import itertools
-        import matplotlib.cm as cm
-        M, N, _ = self.img.shape
-        plt.figure(figsize=(10, 10))
-        plt.imshow(np.zeros((M, N)), cmap='gray')
-
-        espaciado_color = 10
-        index = np.linspace(0, 1, espaciado_color)
-        lista_colores = cm.rainbow(index)
-        index_order = np.arange(espaciado_color)
-        np.random.shuffle(index_order)
-        lista_colores = lista_colores[index_order]
-        colors = itertools.cycle(lista_colores)
-        for idx, dt in enumerate(self.dt_poly):
-            c = next(colors)
-            y, x = dt.exterior.coords.xy
-            plt.plot(x, y, color=c)
-            # plt.scatter(x,y,s=1)
-            if len(self.dt_and_gt_assignation) - 1 < idx:
-                continue
-            gt_idx = self.dt_and_gt_assignation[idx]
-            if gt_idx == FP_ID:
-                plt.plot(x, y, color='w')
-                continue
-            y, x = self.gt_poly[gt_idx].exterior.coords.xy
-            plt.plot(x, y, color=c)
-            # plt.scatter( x,y, s=1)
-
-        plt.axis('off')
-        plt.savefig(f'{self.output_dir}/assigned_dt_gt.png')
-        plt.close()
-
-    def compute_indicators(self):
-        influence_matrix = self._build_influence_area(self.img, self.gt_poly)
-        self._plot_influece_area(influence_matrix, self.gt_poly)
+    def compute_indicators(self, plot=True):
+        """
+        Compute the influence area, assign detections to ground truth rings and count TP, FP, TN and FN
+        @param plot: if True, save the influence area, assignation and dt/gt figures
+        @return: TP, FP, TN, FN
+        """
+        if self.mode == InfluenceMode.polar:
+            influence_matrix = self._build_polar_influence_area(self.gt_poly)
+        else:
+            influence_matrix = self._build_influence_area(self.image_shape, self.gt_poly)
+        self.influence = influence_matrix
         self.dt_and_gt_assignation, self.accuracy_percentage = self._assign_gt_to_dt(influence_matrix, self.dt_poly)
-        self._plot_assignation_between_gt_and_dt()
 
         TP = self.true_positive()
         FP = self.false_positive()
         TN = self.true_negative()
         FN = self.false_negative()
-        self._plot_gt_and_dt_polys(self.img, self.gt_poly, self.dt_poly, n=3, title=f"TP={TP} FP={FP} TN={TN} FN={FN}")
+        self.indicators = (TP, FP, TN, FN)
+        if plot:
+            results = self.get_results()
+            plot_influence_area(get_influence_label_image(results), results["gt_coordinates"], self.output_dir)
+            plot_assignation_between_gt_and_dt(self.image_shape, results["dt_coordinates"],
+                                               results["gt_coordinates"], self.dt_and_gt_assignation, self.output_dir)
+            img = self._img if self._img is not None else self.img_filename
+            plot_gt_and_dt_polys(img, results["gt_coordinates"], results["dt_coordinates"], self.output_dir, n=3,
+                                 title=f"TP={TP} FP={FP} TN={TN} FN={FN}", image_path=self.img_filename)
         return TP, FP, TN, FN
 
-    def _plot_influece_area(self, matriz, list_gt_poly):
-        import itertools
-        import matplotlib.cm as cm
-        M, N, _ = self.img.shape
-        plt.figure(figsize=(15, 15))
-        plt.imshow(np.zeros((M, N)), cmap='gray')
-        espaciado_color = 10
-        index = np.linspace(0, 1, espaciado_color)
-        lista_colores = cm.rainbow(index)
-        index_order = np.arange(espaciado_color)
-        np.random.shuffle(index_order)
-        lista_colores = lista_colores[index_order]
-        colors = itertools.cycle(lista_colores)
-        regiones_id = list(np.unique(matriz).astype(int))
-        # regiones_id.remove(-1)
-
-        for region in regiones_id:
-
-            x, y = np.where(matriz == region)
-            if region == -1:
-                plt.scatter(x, y, s=1, c='w')
-            else:
-                plt.scatter(x, y, s=1, color=next(colors))
-
-        for poly in list_gt_poly:
-            y, x = self.get_x_and_y_coordinates(poly)#poly.exterior.coords.xy
-            plt.plot(y, x, 'k')
-
-        plt.axis('off')
-        plt.savefig(f'{self.output_dir}/influence_area.png')
-        plt.close()
-
-
-def main(dt_file, gt_file, img_filename, output_dir, threshold, cx, cy):
+    def compute_threshold_sweep(self, thresholds):
+        """
+        Compute the indicators for several thresholds reusing a single assignation pass. Only step 7.0 of
+        _assign_gt_to_dt depends on the threshold, so the raw accuracy percentage of each detection is enough.
+        @param thresholds: array of thresholds. Between 0 and 1.
+        @return: dictionary with threshold, TP, FP, FN, P, R and F arrays
+        """
+        if self.raw_accuracy_percentage is None:
+            self.compute_indicators(plot=False)
+
+        return threshold_sweep(self.raw_accuracy_percentage, len(self.gt_poly), thresholds)
+
+    def get_results(self):
+        """
+        Return the metric values and raw arrays computed so far. The dictionary only holds numbers, lists and numpy
+        arrays, so it can be sent to another process and rendered later with render_plots.
+        @return: results dictionary
+        """
+        results = dict(
+            mode=self.mode,
+            Nr=self.Nr,
+            center=list(self.center),
+            image_shape=tuple(self.image_shape),
+            directions=np.asarray(self.directions),
+            gt_coordinates=[poly.get_coordinates(closed=True) for poly in self.gt_poly],
+            dt_coordinates=[poly.get_coordinates(closed=True) for poly in self.dt_poly],
+            influence=self.influence,
+            dt_and_gt_assignation=self.dt_and_gt_assignation,
+            accuracy_percentage=self.accuracy_percentage,
+            raw_accuracy_percentage=self.raw_accuracy_percentage,
+            rmse_matrix=self.rmse_matrix,
+            rmse_per_ring=self.rmse_per_ring,
+            heat_map=self.color_map,
+            RMSE=self.rmse
+        )
+        if self.indicators is not None:
+            TP, FP, TN, FN = self.indicators
+            results.update(TP=TP, FP=FP, TN=TN, FN=FN, P=self.precision(TP, FP, TN, FN),
+                           R=self.recall(TP, FP, TN, FN), F=self.fscore(TP, FP, TN, FN))
+        return results
+
+    def render_plots(self, n_jobs=1):
+        """Render every figure from the results computed so far. See render_plots"""
+        # the image is only decoded if the figure has to be rendered
+        img = self._img if self._img is not None else self.img_filename
+        return render_plots(self.get_results(), img, self.output_dir, n_jobs=n_jobs, image_path=self.img_filename)
+
+
+def threshold_sweep(raw_accuracy_percentage, n_gt, thresholds):
+    """
+    Precision, recall and F-score for an array of thresholds. A detection is a true positive for threshold t if it was
+    assigned to a ground truth ring and its accuracy percentage is >= t. Non assigned detections have accuracy FP_ID.
+    Counts are additive, so a dataset level sweep is obtained by concatenating the raw accuracies of every sample and
+    adding their number of ground truth rings.
+    @param raw_accuracy_percentage: accuracy percentage of every detection before thresholding
+    @param n_gt: number of ground truth rings
+    @param thresholds: array of thresholds. Between 0 and 1.
+    @return: dictionary with threshold, TP, FP, FN, P, R and F arrays
+    """
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+    if np.any(thresholds < 0) or np.any(thresholds > 1):
+        raise ValueError("The thresholds must be between 0 and 1")
+
+    accuracy = np.sort(np.asarray(raw_accuracy_percentage, dtype=float))
+    n_dt = accuracy.shape[0]
+    TP = n_dt - np.searchsorted(accuracy, thresholds, side='left')
+    FP = n_dt - TP
+    FN = n_gt - TP
+
+    P = np.divide(TP, TP + FP, out=np.zeros(thresholds.shape), where=TP + FP > 0)
+    R = np.divide(TP, TP + FN, out=np.zeros(thresholds.shape), where=TP + FN > 0)
+    F = np.divide(2 * P * R, P + R, out=np.zeros(thresholds.shape), where=P + R > 0)
+
+    return dict(threshold=thresholds, TP=TP, FP=FP, FN=FN, P=P, R=R, F=F)
+
+
+def export_pr_curve(sweep, output_dir, filename="pr_curve"):
+    """
+    Save a threshold sweep as a csv table and as a precision-recall curve figure
+    @param sweep: threshold_sweep dictionary
+    @param output_dir: output directory
+    @param filename: output filename without extension
+    @return:
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    columns = ["threshold", "TP", "FP", "FN", "P", "R", "F"]
+    table = np.vstack([sweep[column] for column in columns]).T
+    np.savetxt(output_dir / f"{filename}.csv", table, delimiter=",", header=",".join(columns), comments="",
+               fmt=["%.4f", "%d", "%d", "%d", "%.6f", "%.6f", "%.6f"])
+    plot_pr_curve(sweep, output_dir / f"{filename}.png")
+
+
+########################################################################################################################
+# Plots. Figures are rendered from the raw results arrays, so they can be drawn later or in a worker process.
+########################################################################################################################
+def _shuffled_rainbow_colors(n_colors=10):
+    import matplotlib.cm as cm
+    index = np.linspace(0, 1, n_colors)
+    lista_colores = cm.rainbow(index)
+    index_order = np.arange(n_colors)
+    np.random.shuffle(index_order)
+    return lista_colores[index_order]
+
+
+def _add_poly_to_img(img, y, x, color, thickness=1):
+    isClosed = True
+    pts = np.vstack((x, y)).T.astype(np.int32)
+    pts = pts.reshape((-1, 1, 2))
+
+    return cv.polylines(img, [pts], isClosed, color, thickness)
+
+
+def fill_contour_window(contour, canvas_shape):
+    """
+    Fill a contour as cv.fillPoly does on a canvas_shape array, but only on the window of the canvas covered by the
+    contour bounding box
+    @param contour: (n, 2) int32 contour, in cv.fillPoly (column, row) order
+    @param canvas_shape: (rows, columns) of the canvas
+    @return: boolean window mask and its (row, column) origin in the canvas
+    """
+    rows, cols = canvas_shape
+    c0, r0 = np.maximum(contour.min(axis=0), 0)
+    c1, r1 = np.minimum(contour.max(axis=0) + 1, (cols, rows))
+    window = np.zeros((max(r1 - r0, 0), max(c1 - c0, 0)), dtype=np.uint8)
+    if window.size > 0:
+        # filling the window with an offset gives the same pixels as filling the whole canvas, including the edges
+        # clipped by the canvas border
+        cv.fillPoly(window, pts=[contour], color=1, offset=(-int(c0), -int(r0)))
+    return window > 0, (int(r0), int(c0))
+
+
+def contour_contains(contour, rows, cols, canvas_shape):
+    """
+    Return True for the (rows, cols) pixels that cv.fillPoly sets when filling contour on a canvas_shape array
+    @param contour: (n, 2) int32 contour, in cv.fillPoly (column, row) order
+    @param rows: pixels rows
+    @param cols: pixels columns
+    @param canvas_shape: (rows, columns) of the canvas
+    @return: boolean array
+    """
+    window, (r0, c0) = fill_contour_window(contour, canvas_shape)
+    rows = np.asarray(rows) - r0
+    cols = np.asarray(cols) - c0
+    inside = (rows >= 0) & (rows < window.shape[0]) & (cols >= 0) & (cols < window.shape[1])
+    contained = np.zeros(rows.shape, dtype=bool)
+    contained[inside] = window[rows[inside], cols[inside]]
+    return contained
+
+
+def bands_influence_matrix(bands, image_shape):
+    """
+    Fill the influence band contours into the influence matrix, indexed by (x, y). Outer bands overwrite inner ones
+    @param bands: list of (inner contour, outer contour), see InfluenceArea._build_influence_bands
+    @param image_shape: image height and width
+    @return: influence matrix. Pixels outside every influence area are -1
+    """
+    influence_matrix = np.full((image_shape[1], image_shape[0]), -1, dtype=np.int32)
+    M, N = image_shape[:2]
+    for i, (inner, outer) in enumerate(bands):
+        mask_M = np.zeros((N, M), dtype=np.uint8)
+        cv.fillPoly(mask_M, pts=[outer], color=(255))
+        if inner is None:
+            # 1. First ring
+            mask = mask_M > 0
+
+        else:
+            mask_m = np.zeros((N, M), dtype=np.uint8)
+            cv.fillPoly(mask_m, pts=[inner], color=(255))
+            mask = (mask_M > 0) & (mask_m == 0)
+
+        influence_matrix[mask] = i
+
+    return influence_matrix
+
+
+def get_influence_label_image(results):
+    """
+    Return the (height, width) label image of the influence area stored in results
+    @param results: InfluenceArea.get_results dictionary
+    @return: label image. Pixels outside every influence area are -1
+    """
+    if results["mode"] == InfluenceMode.polar:
+        return bands_influence_matrix(results["influence"], results["image_shape"]).T
+
+    # raster influence matrix is indexed by (x, y)
+    return results["influence"].T
+
+
+def draw_gt_and_dt_polys(fig, img, l_gt, l_dt, n=1, title=None):
+    img_aux = img.copy() if isinstance(img, np.ndarray) else load_image(img)
+    # gt
+    for y, x in l_gt:
+        img_aux = _add_poly_to_img(img_aux, y, x, color=(0, 255, 0), thickness=n)
+
+    # dt
+    for y, x in l_dt:
+        img_aux = _add_poly_to_img(img_aux, y, x, color=(255, 0, 0), thickness=n)
+
+    ax = fig.add_subplot()
+    ax.imshow(img_aux)
+    ax.axis('off')
+    if title is not None:
+        ax.set_title(title)
+
+
+def draw_influence_area(fig, label_image, l_gt):
+    """
+    Draw the influence area label image with imshow. Each region gets a color from a shuffled rainbow palette and
+    pixels outside every influence area are white.
+    """
+    lista_colores = (_shuffled_rainbow_colors()[:, :3] * 255).astype(np.uint8)
+    regions = np.full(label_image.shape + (3,), 255, dtype=np.uint8)
+    inside = label_image >= 0
+    regions[inside] = lista_colores[label_image[inside] % len(lista_colores)]
+
+    ax = fig.add_subplot()
+    ax.imshow(regions, interpolation='nearest')
+    for y, x in l_gt:
+        ax.plot(x, y, 'k')
+
+    ax.axis('off')
+
+
+def draw_assignation_between_gt_and_dt(fig, image_shape, l_dt, l_gt, dt_and_gt_assignation):
+    import itertools
+    M, N = image_shape[:2]
+    ax = fig.add_subplot()
+    ax.imshow(np.zeros((M, N)), cmap='gray')
+
+    colors = itertools.cycle(_shuffled_rainbow_colors())
+    for idx, (y, x) in enumerate(l_dt):
+        c = next(colors)
+        ax.plot(x, y, color=c)
+        if len(dt_and_gt_assignation) - 1 < idx:
+            continue
+        gt_idx = dt_and_gt_assignation[idx]
+        if gt_idx == FP_ID:
+            ax.plot(x, y, color='w')
+            continue
+        y, x = l_gt[gt_idx]
+        ax.plot(x, y, color=c)
+
+    ax.axis('off')
+
+
+def draw_color_map(fig, polar_heat_map, Nr, cmap_label='Spectral'):
+    # polar
+    # https://stackoverflow.com/questions/36513312/polar-heatmaps-in-python
+    n_rings = polar_heat_map.shape[0]
+    rad = np.linspace(0, n_rings, n_rings + 1)
+    theta = np.linspace(0, 2 * np.pi, Nr + 1)
+    th, r = np.meshgrid(theta, rad)
+
+    ax = fig.add_subplot(111, projection='polar')
+    pcm = ax.pcolormesh(th, r, polar_heat_map, cmap=cmap_label)
+    ax.set_yticklabels([])
+    ax.set_xticklabels([])
+    ax.set_theta_zero_location('S')
+    ax.set_title(f'Heat map radial error between dt and gt')
+    fig.colorbar(pcm, ax=ax, orientation="vertical")
+
+
+def draw_rmse_per_ring(fig, l_rmse, overal_rmse):
+    ax = fig.add_subplot()
+    ax.bar(np.arange(0, len(l_rmse)), l_rmse)
+    ax.set_title(f"RMSE global={overal_rmse:.3f}")
+    ax.set_xlabel('Number Ring')
+    ax.set_ylabel('RMSE (per gt)')
+    ax.grid(True)
+
+
+def draw_pr_curve(fig, sweep):
+    best = int(np.argmax(sweep["F"]))
+    ax = fig.add_subplot()
+    ax.plot(sweep["R"], sweep["P"], '.-')
+    ax.scatter(sweep["R"][best], sweep["P"][best], c='r', zorder=3,
+               label=f"th={sweep['threshold'][best]:.2f} F={sweep['F'][best]:.3f}")
+    ax.set_xlim(0, 1.05)
+    ax.set_ylim(0, 1.05)
+    ax.set_xlabel('Recall')
+    ax.set_ylabel('Precision')
+    n_errors = sweep.get("n_errors", 0)
+    ax.set_title('Precision-Recall curve' if n_errors == 0 else
+                 f"Precision-Recall curve (partial: {n_errors} of {sweep['n_samples']} samples not evaluated)")
+    ax.legend()
+    ax.grid(True)
+
+
+def gt_and_dt_polys_plot_job(img, l_gt, l_dt, output_dir, n=1, title=None, image_path=None):
+    """
+    @param img: image matrix, or image filename to be loaded when the figure is rendered
+    @param image_path: image file of img. If given, the figure cache is keyed by the file instead of the image pixels
+    """
+    img = img if isinstance(img, np.ndarray) else Path(img)
+    hash_args = (Path(image_path), l_gt, l_dt) if image_path is not None else None
+    return PlotJob(draw_gt_and_dt_polys, f'{output_dir}/dt_and_gt.png', args=(img, l_gt, l_dt),
+                   kwargs=dict(n=n, title=title), figsize=(10, 10), hash_args=hash_args)
+
+
+def influence_area_plot_job(label_image, l_gt, output_dir):
+    return PlotJob(draw_influence_area, f'{output_dir}/influence_area.png', args=(label_image, l_gt),
+                   figsize=(15, 15))
+
+
+def assignation_plot_job(image_shape, l_dt, l_gt, dt_and_gt_assignation, output_dir):
+    return PlotJob(draw_assignation_between_gt_and_dt, f'{output_dir}/assigned_dt_gt.png',
+                   args=(tuple(image_shape), l_dt, l_gt, dt_and_gt_assignation), figsize=(10, 10))
+
+
+def color_map_plot_job(polar_heat_map, Nr, output_dir, cmap_label='Spectral'):
+    return PlotJob(draw_color_map, f"{output_dir}/heat_map_{cmap_label}.png", args=(polar_heat_map, Nr),
+                   kwargs=dict(cmap_label=cmap_label), figsize=(10, 10))
+
+
+def rmse_per_ring_plot_job(l_rmse, overal_rmse, output_dir):
+    return PlotJob(draw_rmse_per_ring, f"{output_dir}/rmse.png", args=(l_rmse, overal_rmse))
+
+
+def plot_gt_and_dt_polys(img, l_gt, l_dt, output_dir, n=1, title=None, image_path=None):
+    render_plot(gt_and_dt_polys_plot_job(img, l_gt, l_dt, output_dir, n=n, title=title, image_path=image_path))
+
+
+def plot_influence_area(label_image, l_gt, output_dir):
+    render_plot(influence_area_plot_job(label_image, l_gt, output_dir))
+
+
+def plot_assignation_between_gt_and_dt(image_shape, l_dt, l_gt, dt_and_gt_assignation, output_dir):
+    render_plot(assignation_plot_job(image_shape, l_dt, l_gt, dt_and_gt_assignation, output_dir))
+
+
+def plot_color_map(polar_heat_map, Nr, output_dir):
+    render_plot(color_map_plot_job(polar_heat_map, Nr, output_dir))
+
+
+def plot_rmse_per_ring(l_rmse, overal_rmse, output_dir):
+    render_plot(rmse_per_ring_plot_job(l_rmse, overal_rmse, output_dir))
+
+
+def plot_pr_curve(sweep, output_path):
+    render_plot(PlotJob(draw_pr_curve, output_path, args=(sweep,)))
+
+
+def render_plots(results, img, output_dir, n_jobs=1, image_path=None):
+    """
+    Render the influence area figures from a results dictionary. Figures whose data has not been computed are skipped,
+    and so are the figures whose data did not change since they were last rendered.
+    @param results: InfluenceArea.get_results dictionary
+    @param img: image matrix or image filename. A filename is only loaded if the figure has to be rendered
+    @param output_dir: output directory where the figures are saved
+    @param n_jobs: number of processes used to render the figures. See lib.plots.render_plots
+    @param image_path: image file of an img matrix. If given, the figure cache is keyed by the file instead of the
+    image pixels
+    @return: list of rendered figures paths
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    l_gt = results["gt_coordinates"]
+    l_dt = results["dt_coordinates"]
+    jobs = []
+    if results["influence"] is not None:
+        jobs.append(influence_area_plot_job(get_influence_label_image(results), l_gt, output_dir))
+
+    if results["dt_and_gt_assignation"] is not None:
+        jobs.append(assignation_plot_job(results["image_shape"], l_dt, l_gt, results["dt_and_gt_assignation"],
+                                         output_dir))
+        title = f"TP={results['TP']} FP={results['FP']} TN={results['TN']} FN={results['FN']}"
+        image_path = image_path if image_path is not None or isinstance(img, np.ndarray) else img
+        jobs.append(gt_and_dt_polys_plot_job(img, l_gt, l_dt, output_dir, n=3, title=title, image_path=image_path))
+
+    if results["rmse_per_ring"] is not None:
+        jobs.append(rmse_per_ring_plot_job(np.nan_to_num(results["rmse_per_ring"]), results["RMSE"], output_dir))
+
+    if results["heat_map"] is not None:
+        jobs.append(color_map_plot_job(results["heat_map"], results["Nr"], output_dir))
+
+    return render_plots_jobs(jobs, n_jobs=n_jobs)
+
+
+def main(dt_file, gt_file, img_filename, output_dir, threshold, cx, cy, mode=InfluenceMode.raster, headless=False,
+         sweep_thresholds=None):
     """
     Compute the influence area metric between the  ground truth and detection rings. The metric is computed as follows:
     0.0 Sampling the ground truth and detection rings to the same number of nodes. By default, Nr=360
@@ -526,23 +865,35 @@ def main(dt_file, gt_file, img_filename, output_dir, threshold, cx, cy):
     @param threshold: threshold to consider a detection ring as false positive. Between 0 and 1.
     @param cx: x coordinate of the pith disk
     @param cy: y coordinate of the pith disk
-    @return: Precision, Recall, F-score and mean RMSE
+    @param mode: influence area domain. Raster (image sized influence matrix) or polar
+    (band contours, filled around the detection samples)
+    @param headless: if True, no figure is rendered and the raw results dictionary is returned as a trailing item.
+    Figures can be rendered afterwards with render_plots.
+    @param sweep_thresholds: optional array of thresholds. If given, the precision-recall curve over those thresholds
+    is exported to output_dir/pr_curve.csv and output_dir/pr_curve.png
+    @return: Precision, Recall, F-score, mean RMSE, TP, FP, TN and FN, followed by the results dictionary if headless
     """
     if threshold > 1:
         raise ValueError("The threshold must be between 0 and 1")
 
-    metrics = InfluenceArea(gt_file, dt_file, img_filename, output_dir, threshold, cx, cy)
-    TP, FP, TN, FN = metrics.compute_indicators()
+    metrics = InfluenceArea(gt_file, dt_file, img_filename, output_dir, threshold, cx, cy, mode=mode)
+    TP, FP, TN, FN = metrics.compute_indicators(plot=False)
 
     F = metrics.fscore(TP, FP, TN, FN)
     P = metrics.precision(TP, FP, TN, FN)
     R = metrics.recall(TP, FP, TN, FN)
 
-    RMSE = metrics.compute_rmse_global()
+    RMSE = metrics.compute_rmse_global(plot=False)
     print(f"{Path(img_filename).name} P={P:.2f} R={R:.2f} F={F:.2f} RMSE={RMSE:.2f}")
 
-    metrics.generate_radial_error_heat_map()
+    metrics.generate_radial_error_heat_map(plot=False)
+    if sweep_thresholds is not None:
+        export_pr_curve(metrics.compute_threshold_sweep(sweep_thresholds), output_dir)
+
+    if headless:
+        return P, R, F, RMSE, TP, FP, TN, FN, metrics.get_results()
 
+    metrics.render_plots()
     return P, R, F, RMSE, TP, FP, TN, FN
 
 
@@ -557,6 +908,14 @@ if __name__ == "__main__":
     parser.add_argument("--output_dir", type=str, required=True, help="output directory for the results")
     parser.add_argument("--th", type=float, required=True,
                         help="threshold to consider a detection as valid. Between 0 and 1")
+    parser.add_argument("--mode", type=str, default=InfluenceMode.raster,
+                        choices=[InfluenceMode.raster, InfluenceMode.polar],
+                        help="influence area domain. Polar mode does not allocate the image sized influence matrix")
+    parser.add_argument("--headless", action="store_true", help="compute the metrics without rendering figures")
+    parser.add_argument("--sweep", type=int, default=None,
+                        help="export the precision-recall curve for this number of thresholds between 0 and 1")
 
     args = parser.parse_args()
-    main(args.dt_filename, args.gt_filename, args.img_filename, args.output_dir, args.th, args.cx, args.cy)
+    sweep_thresholds = np.linspace(0, 1, args.sweep) if args.sweep is not None else None
+    main(args.dt_filename, args.gt_filename, args.img_filename, args.output_dir, args.th, args.cx, args.cy,
+         mode=args.mode, headless=args.headless, sweep_thresholds=sweep_thresholds)
@@ -9,12 +9,15 @@ You should have received a copy of the GNU Affero General Public License along w
 """
 import numpy as np
 import time
-from shapely.geometry import Point
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from shapely.geometry import Point, Polygon
 from shapely.geometry.linestring import LineString
 import cv2
 
-from lib.cstrd_lib.chain  import Node, euclidean_distance, get_node_from_list_by_angle, Chain, TypeChains
+from lib.cstrd_lib.chain  import Node, euclidean_distance, Chain, TypeChains
 from lib.io import load_json
+from lib.geometry import ring_area
 
 class Ray(LineString):
     def __init__(self, direction, center, M, N):
@@ -79,6 +82,92 @@ def build_rays(Nr, M, N, center):
     return radii_list
 
 
+def image_border_radii_intersection(theta, origin, M, N):
+    """
+    Vectorized version of Ray._image_border_radii_intersection. Compute the image border point reached by each ray
+    direction in a single expression.
+    @param theta: rays directions in degrees
+    @param origin: rays origin (y, x)
+    @param M: image height
+    @param N: image width
+    @return: border points array of shape (Nr, 2) in (y, x) coordinates
+    """
+    degree_to_radians = np.pi / 180
+    theta = np.asarray(theta, dtype=float) % 360
+    yc, xc = origin
+    octant = np.clip((theta // 45).astype(int), 0, 7)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        ye = np.choose(octant, [
+            np.full_like(theta, M - 1),
+            np.tan((90 - theta) * degree_to_radians) * (N - 1 - xc) + yc,
+            yc - np.tan((theta - 90) * degree_to_radians) * (N - 1 - xc),
+            np.zeros_like(theta),
+            np.zeros_like(theta),
+            yc - np.tan((270 - theta) * degree_to_radians) * (xc),
+            np.tan((theta - 270) * degree_to_radians) * (xc) + yc,
+            np.full_like(theta, M - 1)])
+        xe = np.choose(octant, [
+            np.tan(theta * degree_to_radians) * (M - 1 - yc) + xc,
+            np.full_like(theta, N - 1),
+            np.full_like(theta, N - 1),
+            np.tan((180 - theta) * degree_to_radians) * (yc) + xc,
+            xc - np.tan((theta - 180) * degree_to_radians) * (yc),
+            np.zeros_like(theta),
+            np.zeros_like(theta),
+            xc - np.tan((360 - theta) * degree_to_radians) * (M - 1 - yc)])
+
+    return np.column_stack((ye, xe))
+
+
+class RayBundle:
+    """
+    Nr rays going from the center to the image border, stored as arrays. Directions are in degrees, while borders and
+    unit vectors are in (y, x) coordinates. Arrays are read-only because bundles are shared through get_ray_bundle.
+    """
+    def __init__(self, Nr, M, N, center):
+        self.Nr = Nr
+        self.height = M
+        self.width = N
+        self.center = np.array(center, dtype=float)
+        self.directions = np.arange(0, 360, 360 / Nr)
+        self.borders = image_border_radii_intersection(self.directions, self.center, M, N)
+        vectors = self.borders - self.center
+        self.lengths = np.hypot(vectors[:, 0], vectors[:, 1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.unit_vectors = vectors / self.lengths[:, None]
+
+        for array in (self.center, self.directions, self.borders, self.lengths, self.unit_vectors):
+            array.setflags(write=False)
+
+    def __len__(self):
+        return self.Nr
+
+    def __repr__(self):
+        return f'(RayBundle Nr:{self.Nr}, center:{self.center.tolist()}, size:({self.height},{self.width}))'
+
+    def to_rays(self):
+        """Build the equivalent list of shapely Ray objects"""
+        return [Ray(direction, self.center.tolist(), self.height, self.width) for direction in self.directions]
+
+
+@lru_cache(maxsize=32)
+def _cached_ray_bundle(Nr, M, N, center):
+    return RayBundle(Nr, M, N, center)
+
+
+def get_ray_bundle(Nr, M, N, center):
+    """
+    Return the RayBundle for (Nr, M, N, center). Bundles are memoized, so repeated evaluations over the same image only
+    compute the rays once.
+    @param Nr: total rays
+    @param M: image height
+    @param N: image width
+    @param center: (y,x)
+    @return: RayBundle object
+    """
+    return _cached_ray_bundle(int(Nr), int(M), int(N), tuple(float(c) for c in center))
+
+
 def get_coordinates_from_intersection(inter):
     """Shapely intersection formating"""
     if 'MULTI' in inter.wkt:
@@ -102,6 +191,266 @@ def get_coordinates_from_intersection(inter):
     return y, x
 
 
+def rays_to_arrays(l_rays):
+    """
+    Convert a rays list to arrays
+    @param l_rays: rays list or RayBundle
+    @return: rays directions (Nr,) in degrees and rays border points (Nr, 2) in (y, x) coordinates
+    """
+    if isinstance(l_rays, RayBundle):
+        return l_rays.directions, l_rays.borders
+
+    directions = np.array([ray.direction for ray in l_rays], dtype=float)
+    borders = np.array([ray.border for ray in l_rays], dtype=float).reshape(-1, 2)
+    return directions, borders
+
+
+def get_curve_coordinates(curve):
+    """
+    Return curve vertices as an array of shape (K, 2) and whether the curve is a closed ring. Polygons are sampled over
+    their exterior boundary.
+    @param curve: shapely LineString or Polygon
+    @return: vertices array and closed flag
+    """
+    if isinstance(curve, Polygon):
+        return np.asarray(curve.exterior.coords, dtype=float), True
+
+    return np.asarray(curve.coords, dtype=float), False
+
+
+def intersect_rays_with_curve(origin, borders, curve_points, closed=False, chunk_size=2048):
+    """
+    Intersect every ray with a curve in a single NumPy pass over the curve segments. Rays go from origin to border.
+    For closed curves the selected point is the first place where the ray leaves the polygon, which is what the shapely
+    ray/polygon intersection returns. For open curves the first crossing in curve order is selected, as the first point
+    of the shapely ray/curve intersection.
+    For closed curves a segment crosses a ray when its endpoints lie strictly on opposite sides of the ray line
+    (crossing number rule). The side of each vertex is computed once, so a ray through a vertex shared by two segments
+    is counted once or not at all, and the crossings parity is exact.
+    @param origin: rays origin (y, x)
+    @param borders: rays border points, array of shape (Nr, 2) in (y, x) coordinates
+    @param curve_points: curve vertices, array of shape (K, 2) in (y, x) coordinates
+    @param closed: True if the curve is a closed ring
+    @param chunk_size: number of segments processed at once. Bounds the (Nr, chunk_size) working arrays.
+    @return: radii, y and x arrays of shape (Nr,). Rays that miss the curve are set to nan.
+    """
+    origin = np.asarray(origin, dtype=float)
+    d = np.asarray(borders, dtype=float) - origin
+    ray_length = np.hypot(d[:, 0], d[:, 1])
+    nr = d.shape[0]
+
+    points = np.asarray(curve_points, dtype=float)
+    if closed and points.shape[0] > 0 and not np.array_equal(points[0], points[-1]):
+        points = np.vstack((points, points[:1]))
+
+    # closed curves: first and second closest crossings along each ray (ray parameter in [0, 1]) and total crossings.
+    # Open curves: ray parameter of the first crossing in curve order
+    first_and_second = np.full((nr, 2), np.inf)
+    crossings = np.zeros(nr, dtype=int)
+    first_in_curve_order = np.full(nr, np.inf)
+
+    # vertices relative to the origin
+    p = points - origin
+    rows = np.arange(nr)
+    for start in range(0, p.shape[0] - 1, chunk_size):
+        p_c = p[start:start + chunk_size + 1]
+        a_c = p_c[:-1]
+        e_c = p_c[1:] - p_c[:-1]
+        # side of each vertex with respect to the ray line
+        side = np.sign(d[:, 0, None] * p_c[None, :, 1] - d[:, 1, None] * p_c[None, :, 0])
+        # solve origin + t * d = origin + a + u * e using 2D cross products. The denominator is not 0 when the
+        # segment endpoints are on opposite sides
+        denominator = d[:, 0, None] * e_c[None, :, 1] - d[:, 1, None] * e_c[None, :, 0]
+        a_cross_e = a_c[:, 0] * e_c[:, 1] - a_c[:, 1] * e_c[:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = a_cross_e[None, :] / denominator
+
+        if closed:
+            # vertices on the ray line count as being on the negative side
+            positive = side > 0
+            hit = positive[:, :-1] != positive[:, 1:]
+        else:
+            # parity does not matter for open curves, so segments touching the ray line are hits, including the
+            # curve endpoints
+            hit = (side[:, :-1] * side[:, 1:] <= 0) & (denominator != 0)
+        hit &= (t >= 0) & (t <= 1)
+        t = np.where(hit, t, np.inf)
+        if closed:
+            crossings += hit.sum(axis=1)
+            candidates = np.concatenate((first_and_second, t), axis=1)
+            first_and_second = np.partition(candidates, 1, axis=1)[:, :2]
+        else:
+            first_hit = t[rows, hit.argmax(axis=1)]
+            first_in_curve_order = np.where(np.isinf(first_in_curve_order), first_hit, first_in_curve_order)
+
+    if closed:
+        # an odd number of crossings means that the origin is inside the ring. Otherwise the first crossing is the
+        # entry point and the ray leaves the ring at the second one.
+        t = np.where(crossings % 2 == 1, first_and_second[:, 0], first_and_second[:, 1])
+    else:
+        t = first_in_curve_order
+
+    t = np.where(np.isfinite(t), t, np.nan)
+    y = origin[0] + t * d[:, 0]
+    x = origin[1] + t * d[:, 1]
+    radii = t * ray_length
+    return radii, y, x
+
+
+class RingSamples:
+    """
+    Ring sampled by Nr rays. Samples are stored in contiguous float32 arrays where slot k holds the intersection
+    between the ring and ray k. Rays that miss the ring are masked out. The shapely polygon is only built on demand.
+    """
+    def __init__(self, angles, y, x, radii, mask=None):
+        self.angles = np.ascontiguousarray(angles, dtype=np.float32)
+        self.y = np.ascontiguousarray(y, dtype=np.float32)
+        self.x = np.ascontiguousarray(x, dtype=np.float32)
+        self.radii = np.ascontiguousarray(radii, dtype=np.float32)
+        self.mask = np.isfinite(self.radii) if mask is None else np.ascontiguousarray(mask, dtype=bool)
+        self._polygon = None
+        self._slot_by_angle = None
+
+    @classmethod
+    def from_curve(cls, l_rays, curve, center):
+        """
+        Sample a curve with the rays
+        @param l_rays: rays list
+        @param curve: shapely Polygon or LineString in (y, x) coordinates
+        @param center: rays origin (y, x)
+        @return: RingSamples object
+        """
+        directions, borders = rays_to_arrays(l_rays)
+        curve_points, closed = get_curve_coordinates(curve)
+        radii, y, x = intersect_rays_with_curve(center, borders, curve_points, closed=closed)
+        return cls(directions, y, x, radii)
+
+    def __len__(self):
+        return int(self.mask.sum())
+
+    def __repr__(self):
+        return f'(RingSamples Nr:{self.Nr}, samples:{len(self)})'
+
+    @property
+    def Nr(self):
+        return self.angles.shape[0]
+
+    def get_slot_by_angle(self, angle):
+        """
+        Return the ray slot sampled at angle, or None if the ring has no sample in that direction
+        @param angle: ray direction in degrees
+        @return: slot index
+        """
+        if self._slot_by_angle is None:
+            self._slot_by_angle = {}
+            for slot, slot_angle in enumerate(self.angles.astype(int).tolist()):
+                self._slot_by_angle.setdefault(slot_angle, slot)
+
+        slot = self._slot_by_angle.get(int(angle))
+        if slot is None or not self.mask[slot]:
+            return None
+        return slot
+
+    def get_sample_by_angle(self, angle):
+        """
+        Return the (y, x, radial distance) sample at angle, or None if the ray misses the ring
+        @param angle: ray direction in degrees
+        @return: sample tuple
+        """
+        slot = self.get_slot_by_angle(angle)
+        if slot is None:
+            return None
+        return self.y[slot], self.x[slot], self.radii[slot]
+
+    def get_coordinates(self, closed=False):
+        """
+        Return sampled points coordinates ordered by ray direction
+        @param closed: if True, the first point is repeated at the end
+        @return: y and x arrays
+        """
+        y, x = self.y[self.mask], self.x[self.mask]
+        if closed and y.shape[0] > 0:
+            y = np.append(y, y[0])
+            x = np.append(x, x[0])
+        return y, x
+
+    @property
+    def area(self):
+        y, x = self.get_coordinates()
+        return ring_area(np.column_stack((y, x)))
+
+    @property
+    def polygon(self):
+        if self._polygon is None:
+            y, x = self.get_coordinates()
+            self._polygon = Polygon(np.column_stack((y, x)).astype(float))
+        return self._polygon
+
+    @property
+    def exterior(self):
+        return self.polygon.exterior
+
+
+def get_rays_within_bounding_box(origin, directions, curve_points):
+    """
+    Select the rays that can cross the curve bounding box. If the origin is outside the box, the box is seen from the
+    origin inside an angular sector narrower than 180 degrees, and rays outside that sector cannot reach the curve.
+    @param origin: rays origin (y, x)
+    @param directions: rays directions in degrees. Ray direction is (cos, sin) in (y, x) coordinates
+    @param curve_points: curve vertices, array of shape (K, 2) in (y, x) coordinates
+    @return: boolean mask over directions
+    """
+    y_min, x_min = curve_points.min(axis=0) - origin
+    y_max, x_max = curve_points.max(axis=0) - origin
+    if y_min <= 0 <= y_max and x_min <= 0 <= x_max:
+        return np.ones(directions.shape[0], dtype=bool)
+
+    corners_angle = np.degrees(np.arctan2([x_min, x_max, x_min, x_max], [y_min, y_min, y_max, y_max]))
+    relative = (corners_angle - corners_angle[0] + 180) % 360 - 180
+    # small tolerance so that rays through a corner are kept
+    sector_start = corners_angle[0] + relative.min() - 1e-6
+    sector_width = relative.max() - relative.min() + 2e-6
+    return (directions - sector_start) % 360 <= sector_width
+
+
+def sample_curve(origin, directions, borders, curve_points, closed=False):
+    """
+    Intersect the rays with a curve and keep one sample per integer angle, in rays order. Only the rays that can cross
+    the curve bounding box are intersected.
+    @param origin: rays origin (y, x)
+    @param directions: rays directions in degrees
+    @param borders: rays border points, array of shape (Nr, 2) in (y, x) coordinates
+    @param curve_points: curve vertices, array of shape (K, 2) in (y, x) coordinates
+    @param closed: True if the curve is a closed ring
+    @return: angle (int), y, x and radial distance arrays of the curve samples
+    """
+    origin = np.asarray(origin, dtype=float)
+    empty = (np.empty(0, dtype=int), np.empty(0), np.empty(0), np.empty(0))
+    if curve_points.shape[0] == 0:
+        return empty
+
+    rays_idx = np.flatnonzero(get_rays_within_bounding_box(origin, directions, curve_points))
+    if rays_idx.shape[0] == 0:
+        return empty
+
+    radii, y, x = intersect_rays_with_curve(origin, borders[rays_idx], curve_points, closed=closed)
+    valid = ~np.isnan(radii)
+    angles = directions[rays_idx][valid].astype(int)
+    # first sample of each angle, in rays order
+    _, first = np.unique(angles, return_index=True)
+    first.sort()
+    return angles[first], y[valid][first], x[valid][first], radii[valid][first]
+
+
+def build_curve_nodes(angles, y, x, radii, chain_id):
+    """
+    Build the nodes of a sampled curve
+    @return: nodes list
+    """
+    return [Node(**{'y': i, 'x': j, 'angle': angle, 'radial_distance': radial_distance, 'chain_id': chain_id})
+            for angle, i, j, radial_distance in zip(angles.tolist(), y.tolist(), x.tolist(), radii.tolist())]
+
+
 def compute_intersection(l_rays, curve, chain_id, center):
     """
     Compute intersection between rays and devernay curve
@@ -111,26 +460,53 @@ def compute_intersection(l_rays, curve, chain_id, center):
     @param center: disk image center
     @return: nodes list
     """
-    l_curve_nodes = []
-    for radii in l_rays:
-        inter = radii.intersection(curve)
-        if not inter.is_empty:
-            try:
-                y, x = get_coordinates_from_intersection(inter)
-            except NotImplementedError:
-                continue
-            i, j = np.array(y), np.array(x)
-            params = {'y': i, 'x': j, 'angle': int(radii.direction), 'radial_distance':
-                euclidean_distance([i, j], center), 'chain_id': chain_id}
+    directions, borders = rays_to_arrays(l_rays)
+    curve_points, closed = get_curve_coordinates(curve)
+    samples = sample_curve(center, directions, borders, curve_points, closed=closed)
+    return build_curve_nodes(*samples, chain_id)
+
 
-            dot = Node(**params)
-            if dot not in l_curve_nodes and get_node_from_list_by_angle(l_curve_nodes, radii.direction) is None:
-                l_curve_nodes.append(dot)
+# rays shared by the curve sampling workers. Set once per worker by _init_sampling_worker
+_sampling_worker_rays = {}
 
-    return l_curve_nodes
 
+def _init_sampling_worker(center, directions, borders):
+    _sampling_worker_rays.update(center=center, directions=directions, borders=borders)
 
-def intersections_between_rays_and_devernay_curves(center, l_rays, l_curves, min_chain_length, nr, height, width):
+
+def _sample_curve_in_worker(curve_coordinates):
+    curve_points, closed = curve_coordinates
+    return sample_curve(_sampling_worker_rays['center'], _sampling_worker_rays['directions'],
+                        _sampling_worker_rays['borders'], curve_points, closed=closed)
+
+
+def sample_curves(center, l_rays, l_curves, n_jobs=1):
+    """
+    Sample every curve with the rays. With n_jobs > 1 the curves are split across a process pool. Rays are sent once
+    to each worker and curves as coordinate arrays. Results are returned in the curves order.
+    @param center: rays origin (y, x)
+    @param l_rays: rays list or RayBundle
+    @param l_curves: curves list
+    @param n_jobs: number of worker processes
+    @return: list of sample_curve results
+    """
+    directions, borders = rays_to_arrays(l_rays)
+    directions = np.asarray(directions, dtype=float)
+    borders = np.asarray(borders, dtype=float)
+    l_curves_coordinates = [get_curve_coordinates(curve) for curve in l_curves]
+    if n_jobs <= 1 or len(l_curves_coordinates) < 2:
+        return [sample_curve(center, directions, borders, curve_points, closed=closed)
+                for curve_points, closed in l_curves_coordinates]
+
+    n_jobs = min(n_jobs, len(l_curves_coordinates))
+    chunksize = max(1, len(l_curves_coordinates) // (4 * n_jobs))
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_sampling_worker,
+                             initargs=(np.asarray(center, dtype=float), directions, borders)) as executor:
+        return list(executor.map(_sample_curve_in_worker, l_curves_coordinates, chunksize=chunksize))
+
+
+def intersections_between_rays_and_devernay_curves(center, l_rays, l_curves, min_chain_length, nr, height, width,
+                                                   n_jobs=1):
     """
     Compute chains sampling devernay curves.  Sampling is made finding the intersection
     between rays and devernay curves. A chain is a list of nodes. A node is a point in the image with the following
@@ -142,16 +518,18 @@ def intersections_between_rays_and_devernay_curves(center, l_rays, l_curves, min
     @param nr: number of rays
     @param height: image height
     @param width: image widht
+    @param n_jobs: number of processes used to sample the curves
     @return: nodes list and chain list
     """
+    l_samples = sample_curves(center, l_rays, l_curves, n_jobs=n_jobs)
+    # chain ids are assigned following the curves order, so they do not depend on n_jobs
     l_chain, l_nodes = [], []
-    for idx, curve in enumerate(l_curves):
-        chain_id = len(l_chain)
-        l_curve_nodes = compute_intersection(l_rays, curve, chain_id, center)
-
-        if len(l_curve_nodes) < min_chain_length:
+    for samples in l_samples:
+        if samples[0].shape[0] < min_chain_length:
             continue
 
+        chain_id = len(l_chain)
+        l_curve_nodes = build_curve_nodes(*samples, chain_id)
         l_nodes += l_curve_nodes
         chain = Chain(chain_id, nr, center=center, img_height=height, img_width=width)
         chain.add_nodes_list(l_curve_nodes)
@@ -243,7 +621,7 @@ def add_gt_rings_as_chain(chains_list, nodes_list, gt_ring_json, height, width,
     return
 
 def sampling_edges(l_ch_f, cy, cx, im_pre, min_chain_length, nr, debug=False, gt_ring_json = None,
-                   include_gt_rings_in_output=False):
+                   include_gt_rings_in_output=False, n_jobs=1):
     """
     Devernay curves are sampled using the rays directions. Implements Algoritm 7 in the paper.
     @param l_ch_f:  edges devernay curves
@@ -253,6 +631,7 @@ def sampling_edges(l_ch_f, cy, cx, im_pre, min_chain_length, nr, debug=False, gt
     @param nr: total ray number
     @param min_chain_length:  minumim chain length
     @param debug: debugging flag
+    @param n_jobs: number of processes used to sample the curves
     @return:
     - l_ch_s: sampled edges curves. List of chain objects
     - l_nodes_s: nodes list.
@@ -260,10 +639,10 @@ def sampling_edges(l_ch_f, cy, cx, im_pre, min_chain_length, nr, debug=False, gt
     # Line 1
     height, width = im_pre.shape
     # Line 2
-    l_rays = build_rays(nr, height, width, [cy, cx])
+    l_rays = get_ray_bundle(nr, height, width, [cy, cx])
     # Line 3
     l_nodes_s, l_ch_s = intersections_between_rays_and_devernay_curves([cy, cx], l_rays, l_ch_f, min_chain_length, nr,
-                                                                       height, width)
+                                                                       height, width, n_jobs=n_jobs)
 
     # Add gt rings as a chain
     add_gt_rings_as_chain(l_ch_s, l_nodes_s, gt_ring_json, height, width, cy, cx,
@@ -275,7 +654,7 @@ def sampling_edges(l_ch_f, cy, cx, im_pre, min_chain_length, nr, debug=False, gt
     # Debug purposes, not illustrated in the paper
     if debug:
         img_draw = np.zeros((im_pre.shape[0], im_pre.shape[1], 3))
-        draw_ray_curve_and_intersections(l_nodes_s, l_rays, l_ch_f, img_draw, './dots_curve_and_rays.png')
+        draw_ray_curve_and_intersections(l_nodes_s, l_rays.to_rays(), l_ch_f, img_draw, './dots_curve_and_rays.png')
 
     # Line 5
     return l_ch_s, l_nodes_s
@@ -0,0 +1,109 @@
+"""
+Vectorized planar geometry of closed rings. Rings are (n, 2) coordinate arrays, without repeating the first point, in
+any coordinate order (results keep that order). A batch of rings is packed into one concatenated points array plus
+offsets, so area, perimeter, centroid and bounding box of every ring are computed in one pass (shoelace formula)
+without building shapely polygons.
+"""
+import numpy as np
+from typing import List
+
+
+def pack_rings(l_rings: List[np.ndarray]):
+    """
+    Concatenate a ragged list of rings
+    @param l_rings: list of (n_i, 2) coordinate arrays
+    @return: (N, 2) float points array and (R + 1,) offsets. Ring r is points[offsets[r]:offsets[r+1]]
+    """
+    l_rings = [np.asarray(ring, dtype=float).reshape(-1, 2) for ring in l_rings]
+    offsets = np.zeros(len(l_rings) + 1, dtype=np.int64)
+    np.cumsum([ring.shape[0] for ring in l_rings], out=offsets[1:])
+    points = np.concatenate(l_rings) if len(l_rings) > 0 else np.empty((0, 2))
+    return points, offsets
+
+
+def rings_geometry(points: np.ndarray, offsets: np.ndarray):
+    """
+    Area, perimeter, centroid and bounding box of a packed batch of rings. The closing segment (last point to first
+    point) is implicit, as in shapely. Rings with less than 3 points have area 0 and their centroid is the mean of
+    their points. Empty rings get nan centroid and bounds.
+    @param points: (N, 2) concatenated points. See pack_rings
+    @param offsets: (R + 1,) rings offsets
+    @return: area (R,), perimeter (R,), centroid (R, 2) and bounds (R, 4) as (min0, min1, max0, max1)
+    """
+    points = np.asarray(points, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_rings = offsets.shape[0] - 1
+    lengths = np.diff(offsets)
+    non_empty = lengths > 0
+    area = np.zeros(n_rings)
+    perimeter = np.zeros(n_rings)
+    centroid = np.full((n_rings, 2), np.nan)
+    bounds = np.full((n_rings, 4), np.nan)
+    if points.shape[0] == 0:
+        return area, perimeter, centroid, bounds
+
+    ring_id = np.repeat(np.arange(n_rings), lengths)
+    start = offsets[:-1]
+    # index of the next vertex, wrapping around at the end of each ring
+    next_idx = np.arange(1, points.shape[0] + 1)
+    next_idx[offsets[1:][non_empty] - 1] = start[non_empty]
+
+    # coordinates relative to the first vertex of each ring, for numerical precision
+    origin = points[np.minimum(start, points.shape[0] - 1)]
+    p = points - origin[ring_id]
+    q = p[next_idx]
+    cross = p[:, 0] * q[:, 1] - q[:, 0] * p[:, 1]
+
+    signed_area = 0.5 * np.bincount(ring_id, weights=cross, minlength=n_rings)
+    area = np.abs(signed_area)
+    perimeter = np.bincount(ring_id, weights=np.hypot(q[:, 0] - p[:, 0], q[:, 1] - p[:, 1]), minlength=n_rings)
+
+    counts = np.maximum(lengths, 1)
+    mean = np.vstack([np.bincount(ring_id, weights=p[:, axis], minlength=n_rings) / counts for axis in (0, 1)]).T
+    moment = np.vstack([np.bincount(ring_id, weights=(p[:, axis] + q[:, axis]) * cross, minlength=n_rings)
+                        for axis in (0, 1)]).T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        polygon_centroid = moment / (6 * signed_area[:, None])
+    centroid = np.where((signed_area != 0)[:, None], polygon_centroid, mean) + origin
+    centroid[~non_empty] = np.nan
+
+    starts = start[non_empty]
+    bounds[non_empty, :2] = np.minimum.reduceat(points, starts, axis=0)
+    bounds[non_empty, 2:] = np.maximum.reduceat(points, starts, axis=0)
+
+    return area, perimeter, centroid, bounds
+
+
+def rings_area(l_rings: List[np.ndarray]):
+    """
+    Area of each ring of a ragged list of rings
+    @param l_rings: list of (n_i, 2) coordinate arrays
+    @return: (R,) areas
+    """
+    area, _, _, _ = rings_geometry(*pack_rings(l_rings))
+    return area
+
+
+def ring_geometry(ring: np.ndarray):
+    """
+    Area, perimeter, centroid and bounds of a single ring
+    @param ring: (n, 2) coordinate array
+    @return: area, perimeter, (2,) centroid and (4,) bounds
+    """
+    area, perimeter, centroid, bounds = rings_geometry(*pack_rings([ring]))
+    return area[0], perimeter[0], centroid[0], bounds[0]
+
+
+def ring_area(ring: np.ndarray):
+    return rings_area([ring])[0]
+
+
+def region_centroid(exterior_area, exterior_centroid, hole_area, hole_centroid):
+    """
+    Centroid of the region between an exterior ring and a hole inside it
+    @return: centroid coordinates
+    """
+    area = exterior_area - hole_area
+    if area == 0:
+        return np.asarray(exterior_centroid, dtype=float)
+    return (exterior_area * np.asarray(exterior_centroid) - hole_area * np.asarray(hole_centroid)) / area
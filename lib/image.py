@@ -1,8 +1,10 @@
 import os
+import warnings
 import numpy as np
 import cv2
 
 from abc import ABC, abstractmethod
+from functools import lru_cache
 from PIL import Image
 from shapely.geometry import Polygon
 
@@ -96,6 +98,44 @@ class Drawing:
 
         return img
 
+    @staticmethod
+    def fill_region(image, exterior, hole, color, opacity):
+        """
+        Blend color over the region between an exterior and a hole boundary. The result is the same as blending a
+        full size mask of the region over the whole image, but only the region bounding box is rasterized: outside it
+        the blend reduces to scaling the image by (1 - opacity).
+        @param image: image to draw on. It is modified in place
+        @param exterior: (n, 2) exterior (y, x) coordinates
+        @param hole: (m, 2) hole (y, x) coordinates or None
+        @param color: region color
+        @param opacity: color opacity
+        @return: image
+        """
+        height, width = image.shape[:2]
+        l_rings = [np.asarray(exterior).astype(int)]
+        if hole is not None:
+            l_rings.append(np.asarray(hole).astype(int))
+        points = np.vstack(l_rings)
+        y0, x0 = np.maximum(points.min(axis=0), 0)
+        y1, x1 = np.minimum(points.max(axis=0) + 1, [height, width])
+
+        roi = image[y0:y1, x0:x1].copy()
+        cv2.convertScaleAbs(image, image, alpha=1 - opacity)
+        if y1 <= y0 or x1 <= x0:
+            return image
+
+        origin = np.array([x0, y0])
+        masks = []
+        for ring in l_rings:
+            mask = np.zeros_like(roi)
+            cv2.fillPoly(mask, [ring[:, ::-1] - origin], Color.white)
+            masks.append(mask)
+        # uint8 difference, as the full size masks
+        mask = masks[0] - masks[1] if hole is not None else masks[0]
+        mask[mask[:, :, 0] > 0] = color
+        image[y0:y1, x0:x1] = cv2.addWeighted(mask, opacity, roi, 1 - opacity, 0)
+        return image
+
     @staticmethod
     def fill(poly, image, color, opacity=0):
         y, x = poly.xy
@@ -153,6 +193,49 @@ def load_image(image_path):
     """Load image from path"""
     return cv2.imread(str(image_path),cv2.IMREAD_UNCHANGED)
 
+
+# number of channels of load_image for each PIL mode. Palette images are expanded to BGR(A) by OpenCV
+CV2_CHANNELS_BY_PIL_MODE = {"1": 1, "L": 1, "P": 3, "I": 1, "F": 1, "I;16": 1, "I;16B": 1, "I;16L": 1, "LA": 4,
+                            "PA": 4, "RGB": 3, "RGBA": 4, "CMYK": 3, "YCbCr": 3}
+
+
+def get_image_info(image_path):
+    """
+    Image height, width and number of channels read from the file header, without decoding the pixels. Results are
+    cached per path, modification time and size
+    @param image_path: image path
+    @return: height, width and number of channels of load_image(image_path)
+    """
+    stat = os.stat(image_path)
+    return _get_image_info(str(image_path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=256)
+def _get_image_info(image_path, mtime_ns, size):
+    try:
+        # only the header is read. The decompression bomb check does not apply since pixels are never decoded
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(image_path) as pil_img:
+                width, height = pil_img.size
+                mode = pil_img.mode
+                has_transparency = "transparency" in pil_img.info
+
+    except (OSError, Image.DecompressionBombError):
+        # format unknown to PIL or too large for its header check: decode it
+        image = load_image(image_path)
+        if image is None:
+            raise ValueError(f"Can not read image {image_path}")
+        height, width = image.shape[:2]
+        return height, width, 1 if image.ndim == 2 else image.shape[2]
+
+    channels = CV2_CHANNELS_BY_PIL_MODE.get(mode)
+    if channels is None:
+        channels = Image.getmodebands(mode)
+    if mode == "P" and has_transparency:
+        channels = 4
+    return height, width, channels
+
 def write_image(image_path, image):
     """Write image to path"""
     cv2.imwrite(str(image_path), image)
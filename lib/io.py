@@ -1,14 +1,38 @@
 import json
+import os
 import sys
 
-def load_json(filepath: str) -> dict:
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads_json(content: bytearray) -> dict:
+    """
+    Parse json content, with orjson when it is installed
+    :param content: raw json content
+    :return: the loaded json as a dictionary
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def load_json(filepath: str, skip_image_data: bool = False) -> dict:
     """
     Load json utility.
     :param filepath: file to json file
+    :param skip_image_data: if True, the labelme base64 imageData field is loaded as None. The file is fully parsed
+    and the image data is dropped right after, so it is not kept in memory
     :return: the loaded json as a dictionary
     """
-    with open(str(filepath), 'r') as f:
-        data = json.load(f)
+    with open(str(filepath), 'rb') as f:
+        content = bytearray(os.fstat(f.fileno()).st_size)
+        del content[f.readinto(content):]
+    data = loads_json(content)
+    if skip_image_data and isinstance(data, dict) and "imageData" in data:
+        data["imageData"] = None
     return data
 
 
@@ -0,0 +1,162 @@
+"""
+Binary cache of labelme annotation files. The shapes of a labelme json file are stored as one flat float64 .npy array,
+holding the (y, x) coordinates of every shape followed by their geometry, which is memory mapped on load, plus a small
+metadata file with the remaining fields. Cache files are kept in the application output directory (DEFAULT_CACHE_DIR),
+named after a hash of the json file path, so nothing is written next to the annotations, which may be in read only or
+shared directories. The cache is valid while the json file path, modification time and size are the ones recorded in
+the metadata, otherwise it is rebuilt from the json file.
+"""
+import json
+import os
+import hashlib
+import itertools
+import numpy as np
+
+from pathlib import Path
+
+from lib.io import load_json, loads_json
+from lib.geometry import rings_geometry
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent.parent / "output" / "labelme_cache"
+# area, perimeter, centroid (y, x) and bounds (y_min, x_min, y_max, x_max) of each shape
+GEOMETRY_COLUMNS = 8
+
+
+class LabelmeArrays:
+    def __init__(self, header: dict, shapes: list, points: np.ndarray, offsets: np.ndarray, geometry: np.ndarray):
+        """
+        Labelme file content without imageData
+        @param header: top level fields, except shapes and imageData
+        @param shapes: fields of each shape, except points
+        @param points: (N, 2) concatenated (y, x) points of all the shapes
+        @param offsets: (R + 1,) offsets. Shape r points are points[offsets[r]:offsets[r+1]]
+        @param geometry: (R, GEOMETRY_COLUMNS) geometry of each shape. See lib.geometry.rings_geometry
+        """
+        self.header = header
+        self.shapes = shapes
+        self.points = points
+        self.offsets = offsets
+        self.geometry = geometry
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def get_shape_points(self, idx):
+        return self.points[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def get_shape_geometry(self, idx):
+        """
+        @return: area, perimeter, (y, x) centroid and (y_min, x_min, y_max, x_max) bounds of shape idx
+        """
+        row = self.geometry[idx]
+        return row[0], row[1], row[2:4], row[4:8]
+
+
+def labelme_json_to_arrays(labelme_json: dict):
+    """
+    Parse the points of all the shapes into one concatenated (y, x) array and compute the geometry of every shape in
+    one batch
+    @param labelme_json: labelme file content
+    @return: LabelmeArrays
+    """
+    shapes_json = labelme_json["shapes"]
+    offsets = np.zeros(len(shapes_json) + 1, dtype=np.int64)
+    np.cumsum([len(shape['points']) for shape in shapes_json], out=offsets[1:])
+    coordinates = itertools.chain.from_iterable(
+        itertools.chain.from_iterable(shape['points'] for shape in shapes_json))
+    points = np.fromiter(coordinates, dtype=float, count=2 * offsets[-1]).reshape(-1, 2)[:, [1, 0]]
+    area, perimeter, centroid, bounds = rings_geometry(points, offsets)
+    geometry = np.column_stack([area, perimeter, centroid, bounds]).reshape(-1, GEOMETRY_COLUMNS)
+
+    header = {key: value for key, value in labelme_json.items() if key not in ("shapes", "imageData")}
+    shapes = [{key: value for key, value in shape.items() if key != "points"} for shape in shapes_json]
+    return LabelmeArrays(header, shapes, points, offsets, geometry)
+
+
+def get_cache_paths(json_path, cache_dir=None):
+    """
+    @return: data and metadata cache paths of a labelme json file, in cache_dir (by default DEFAULT_CACHE_DIR) and named
+    after the json file path
+    """
+    json_path = Path(json_path).resolve()
+    prefix = Path(cache_dir if cache_dir is not None else DEFAULT_CACHE_DIR) / f"{json_path.stem}.{hashlib.sha1(str(json_path).encode()).hexdigest()}"
+    return Path(f"{prefix}.npy"), Path(f"{prefix}.meta")
+
+
+def _read_cache(json_path, json_stat, cache_dir):
+    data_path, meta_path = get_cache_paths(json_path, cache_dir)
+    try:
+        with open(meta_path, 'rb') as f:
+            meta = loads_json(f.read())
+        if (meta["cache_version"] != CACHE_VERSION or meta["source_path"] != str(Path(json_path).resolve()) or
+                meta["source_mtime_ns"] != json_stat.st_mtime_ns or meta["source_size"] != json_stat.st_size):
+            return None
+        offsets = np.asarray(meta["offsets"], dtype=np.int64)
+        n_coordinates = 2 * int(offsets[-1])
+        size = n_coordinates + GEOMETRY_COLUMNS * len(meta["shapes"])
+        # copy on write mapping: views are writable, but changes never reach the file
+        data = np.load(data_path, mmap_mode='c' if size > 0 else None)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    if data.shape != (size,) or data.dtype != np.float64:
+        return None
+    points = data[:n_coordinates].reshape(-1, 2)
+    geometry = data[n_coordinates:].reshape(-1, GEOMETRY_COLUMNS)
+    return LabelmeArrays(meta["header"], meta["shapes"], points, offsets, geometry)
+
+
+def _write_cache(json_path, json_stat, arrays: LabelmeArrays, cache_dir):
+    data_path, meta_path = get_cache_paths(json_path, cache_dir)
+    meta = dict(
+        cache_version=CACHE_VERSION,
+        source_path=str(Path(json_path).resolve()),
+        source_mtime_ns=json_stat.st_mtime_ns,
+        source_size=json_stat.st_size,
+        header=arrays.header,
+        shapes=arrays.shapes,
+        offsets=arrays.offsets.tolist()
+    )
+    data = np.concatenate([arrays.points.ravel(), arrays.geometry.ravel()]).astype(np.float64)
+    # write to temporary files and rename them, so readers never see partial files. Data goes first: a metadata file
+    # is never newer than its data
+    tmp_suffix = f".{os.getpid()}.tmp"
+    try:
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{data_path}{tmp_suffix}", 'wb') as f:
+            np.save(f, data)
+        os.replace(f"{data_path}{tmp_suffix}", data_path)
+        with open(f"{meta_path}{tmp_suffix}", 'w') as f:
+            json.dump(meta, f)
+        os.replace(f"{meta_path}{tmp_suffix}", meta_path)
+    except (OSError, TypeError, ValueError):
+        # read only cache directory, mapped file in use or non serializable fields. The cache is optional
+        for path in (f"{data_path}{tmp_suffix}", f"{meta_path}{tmp_suffix}"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def load_labelme_arrays(json_path, use_cache: bool = True, cache_dir=None):
+    """
+    Load the shapes of a labelme json file from its cache, rebuilding it if the json file changed
+    @param json_path: labelme json file
+    @param use_cache: if False, the json file is parsed and no cache file is read or written
+    @param cache_dir: cache directory, by default DEFAULT_CACHE_DIR. It is created when the first cache file is written
+    @return: LabelmeArrays. Points and geometry are views of the memory mapped cache
+    @raise FileNotFoundError: if json_path is None or does not exist
+    """
+    if json_path is None:
+        raise FileNotFoundError("labelme json path is None")
+    json_stat = os.stat(json_path)
+    if use_cache:
+        arrays = _read_cache(json_path, json_stat, cache_dir)
+        if arrays is not None:
+            return arrays
+
+    arrays = labelme_json_to_arrays(load_json(json_path, skip_image_data=True))
+    if use_cache:
+        _write_cache(json_path, json_stat, arrays, cache_dir)
+    return arrays
@@ -6,11 +6,18 @@ import cv2
 import pandas as pd
 
 from pathlib import Path
-from shapely.geometry import Polygon, Point, LineString
+from shapely.geometry import Polygon, Point, LineString, LinearRing
 from typing import List
 import datetime
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from lib.image import Color, Drawing, resize_image_using_pil_lib, load_image, write_image
+from lib.geometry import rings_geometry, pack_rings, region_centroid
+from lib.report import generate_report, submit_report
+from lib.plots import PlotJob, render_plots, set_year_ticks
 from backend.labelme_layer import AL_AnnualRings
 
 
@@ -91,102 +98,279 @@ def fill_df(annual_ring_label_list, year_list, ew_lw_label_list, ring_area_list,
 
 
 def compute_angle(vector):
+    """
+    Angle of a vector in degrees, in [0, 360)
+    @param vector: (x, y) components. Scalars or arrays
+    @return: angle or array of angles
+    """
     x, y = vector
     angle_radians = np.arctan2(y, x)
     angle_degrees = np.degrees(angle_radians)
-    angle_360 = angle_degrees if angle_degrees >= 0 else angle_degrees + 360
-    return angle_360
+    angle_360 = np.where(angle_degrees >= 0, angle_degrees, angle_degrees + 360)
+    return angle_360 if angle_360.ndim > 0 else angle_360.item()
+
+
+def compute_ring_properties(exterior_list, hole_list, boundary_list):
+    """
+    Ring properties of a disk computed in one pass. Every boundary is packed in one batch and its area, perimeter and
+    centroid are computed with the shoelace kernel (lib.geometry).
+    @param exterior_list: exterior (y, x) coordinates of each ring, sorted from the pith outwards
+    @param hole_list: hole (y, x) coordinates of each ring, or None (pith ring)
+    @param boundary_list: earlywood/latewood boundary (y, x) coordinates of each ring, or None
+    @return: ring area, earlywood area, latewood area, perimeter, eccentricity module and eccentricity phase arrays
+    """
+    n_rings = len(exterior_list)
+    if n_rings == 0:
+        return tuple(np.zeros(0) for _ in range(6))
+
+    l_rings = list(exterior_list)
+    hole_idx = np.full(n_rings, -1)
+    boundary_idx = np.full(n_rings, -1)
+    for idx, (hole, boundary) in enumerate(zip(hole_list, boundary_list)):
+        if hole is not None:
+            hole_idx[idx] = len(l_rings)
+            l_rings.append(hole)
+        if boundary is not None:
+            boundary_idx[idx] = len(l_rings)
+            l_rings.append(boundary)
+    area, perimeter, centroid, _ = rings_geometry(*pack_rings(l_rings))
+
+    has_hole = hole_idx >= 0
+    has_boundary = boundary_idx >= 0
+    exterior_area = area[:n_rings]
+    hole_area = np.where(has_hole, area[hole_idx], 0)
+    boundary_area = np.where(has_boundary, area[boundary_idx], 0)
+
+    ring_area = exterior_area - hole_area
+    ew_area = np.where(has_boundary, boundary_area - hole_area, 0)
+    lw_area = np.where(has_boundary, exterior_area - boundary_area, ring_area)
+    ring_perimeter = perimeter[:n_rings]
+
+    # eccentricity. The pith is the centroid of the first ring region
+    ring_centroid = centroid[:n_rings]
+    pith = region_centroid(exterior_area[0], ring_centroid[0], hole_area[0],
+                           centroid[hole_idx[0]] if has_hole[0] else ring_centroid[0])
+    # change origin to pith
+    displacement = ring_centroid - pith
+    eccentricity_module = np.hypot(displacement[:, 0], displacement[:, 1])
+    # change reference y-axis to the opposite direction
+    eccentricity_phase = compute_angle((-displacement[:, 0], displacement[:, 1]))
+    eccentricity_phase = np.where(eccentricity_module == 0, 0, eccentricity_phase)
+
+    return ring_area, ew_area, lw_area, ring_perimeter, eccentricity_module, eccentricity_phase
 
 
 def extract_ring_properties(annual_rings_list, year, plantation_date):
-    pith = Point(0, 0)
-    #image_full = image.copy()
-    ring_area_list = []
-    ew_area_list = []
-    lw_area_list = []
-    ring_perimeter_list = []
-    eccentricity_module_list = []
-    eccentricity_phase_list = []
+    exterior_list = [ring.external_points for ring in annual_rings_list]
+    hole_list = [ring.internal_points for ring in annual_rings_list]
+    boundary_list = [ring.early_wood.external_points if ring.early_wood is not None else None
+                     for ring in annual_rings_list]
+    (ring_area_list, ew_area_list, lw_area_list, ring_perimeter_list, eccentricity_module_list,
+     eccentricity_phase_list) = compute_ring_properties(exterior_list, hole_list, boundary_list)
+
+    #metadata
     year_list = []
     annual_ring_label_list = []
     ew_lw_label_list = []
-
-    for idx, ring in enumerate(annual_rings_list):
-        #area
-        ring_area_list.append(ring.area)
-        latewood_area = ring.late_wood.area if ring.late_wood is not None else 0
-        earlywood_area = ring.early_wood.area if ring.early_wood is not None else 0
-        ew_area_list.append(earlywood_area)
-        lw_area_list.append(latewood_area)
-
-        #eccentricity
-        if idx == 0:
-            pith = ring.centroid
-        ring_centroid = ring.get_centroid()
-        eccentricity_module = ring_centroid.distance(pith)
-        if eccentricity_module == 0:
-            eccentricity_phase = 0
-        else:
-            #change reference y-axis to the opposite direction
-            convert_to_numpy = lambda point: np.multiply(np.array([point.coords.xy[0], point.coords.xy[1]]).squeeze(),
-                                                         np.array([-1, 1]))
-            numpy_ring_centroid = convert_to_numpy(ring_centroid).squeeze()
-
-            numpy_pith = convert_to_numpy(pith).squeeze()
-            #change origin to pith
-            numpy_ring_centroid_referenced_to_pith = numpy_ring_centroid - numpy_pith
-            #normalize
-            numpy_ring_centroid_referenced_to_pith_normalized = numpy_ring_centroid_referenced_to_pith / np.linalg.norm(
-                numpy_ring_centroid_referenced_to_pith)
-
-            angle = compute_angle(numpy_ring_centroid_referenced_to_pith_normalized)
-            eccentricity_phase = angle
-
-        eccentricity_module_list.append(eccentricity_module)
-        eccentricity_phase_list.append(eccentricity_phase)
-        ring_perimeter_list.append(ring.exterior.length)
-
-        #metadata
+    for ring in annual_rings_list:
         year_list.append(year.year)
         annual_ring_label_list.append(ring.main_label)
         ew_lw_label_list.append(ring.secondary_label)
-        #save results
         year = year + datetime.timedelta(days=366) if plantation_date else year - datetime.timedelta(days=365)
 
     return annual_ring_label_list, year_list, ew_lw_label_list, ring_area_list, ew_area_list, eccentricity_module_list, eccentricity_phase_list, ring_perimeter_list
 
 
-def debug_images(annual_rings_list, df, image_path, output_dir):
+def draw_ring_debug_image(base_image, ring, pith, scale, thickness, opacity=0.1):
+    """
+    Ring preview over a downscaled image: latewood and earlywood regions, ring boundaries and an arrow from the pith to
+    the ring centroid. Drawing is bounded to the ring bounding box (see Drawing.fill_region)
+    @param base_image: downscaled image. It is not modified
+    @param ring: AnnualRing in full resolution coordinates
+    @param pith: pith point in base_image coordinates
+    @param scale: (y, x) factors from full resolution to base_image coordinates
+    @param thickness: curves thickness
+    @param opacity: regions opacity
+    @return: preview image
+    """
+    image = base_image.copy()
+    exterior = np.asarray(ring.external_points) * scale
+    hole = np.asarray(ring.internal_points) * scale if ring.internal_points is not None else None
+    if ring.early_wood is not None:
+        boundary = np.asarray(ring.early_wood.external_points) * scale
+        image = Drawing.fill_region(image, exterior, boundary, Color.blue, opacity)
+        image = Drawing.fill_region(image, boundary, hole, Color.green, opacity)
+    else:
+        image = Drawing.fill_region(image, exterior, hole, Color.blue, opacity)
+
+    image = Drawing.curve(LinearRing(exterior).coords, image, Color.black, thickness)
+    if hole is not None:
+        image = Drawing.curve(LinearRing(hole).coords, image, Color.black, thickness)
+    ring_centroid = Point(np.array(ring.get_centroid().coords[0]) * scale)
+    image = Drawing.arrow(image, pith, ring_centroid, Color.red, thickness=thickness)
+    return image
+
+
+def load_base_image(image_path, size):
+    """
+    Load an image and downscale it once for the previews
+    @param size: largest side of the downscaled image
+    @return: downscaled image, (y, x) scale factors from full resolution and curves thickness
+    """
     image = load_image(image_path)
-    image_full = image.copy()
-    for idx, ring in enumerate(annual_rings_list):
-        #eccentricity
-        if idx == 0:
-            pith = ring.centroid
-        ring_centroid = ring.get_centroid()
-        image_full = ring.draw_rings(image_full, thickness=3)
-        thickness = 3
-        image_debug = ring.draw(image.copy(), full_details=True, opacity=0.1)
-        image_debug = Drawing.curve(ring.exterior.coords, image_debug, Color.black, thickness)
-        inner_points = np.array([list(interior.coords) for interior in ring.interiors]).squeeze()
-        if len(inner_points) > 0:
-            aux_poly = Polygon(inner_points)
-            image_debug = Drawing.curve(aux_poly.exterior.coords, image_debug, Color.black, thickness)
-            #draw arrow from centroid to pith
-        image_debug = Drawing.arrow(image_debug, pith, ring_centroid, Color.red, thickness=3)
-        output_name = f"{output_dir}/{idx}_ring_properties_label_{ring.main_label}.png"
-        image_debug = resize_image_using_pil_lib(image_debug, 640, 640)
-        write_image(output_name, image_debug)
-
-    image_full = resize_image_using_pil_lib(image_full, 640, 640)
-    write_image(f"{output_dir}/rings.png", image_full)
+    height, width = image.shape[:2]
+    base_image = resize_image_using_pil_lib(image, size, size)
+    scale = np.array(base_image.shape[:2]) / [height, width]
+    # full resolution previews used thickness 3
+    thickness = max(1, int(round(3 * scale.min())))
+    return base_image, scale, thickness
+
+
+def draw_rings_image(base_image, annual_rings_list, scale, thickness):
+    """
+    Ring boundaries (blue) and earlywood/latewood boundaries (red) over a downscaled image
+    @return: new image
+    """
+    image_full = base_image.copy()
+    for ring in annual_rings_list:
+        image_full = Drawing.curve(LinearRing(np.asarray(ring.external_points) * scale).coords, image_full,
+                                   Color.blue, thickness)
+        if ring.early_wood is not None:
+            image_full = Drawing.curve(LinearRing(np.asarray(ring.early_wood.external_points) * scale).coords,
+                                       image_full, Color.red, thickness)
+    return image_full
+
+
+def debug_images(annual_rings_list, df, image_path, output_dir, size=640, n_jobs=None):
+    """
+    Write a preview per ring and an image with all the rings. The image is downscaled once to size and ring geometry
+    is scaled to match. Per ring previews are rendered in a thread pool (OpenCV releases the GIL)
+    @param size: previews largest side
+    @param n_jobs: number of threads. If None, ThreadPoolExecutor default
+    """
+    base_image, scale, thickness = load_base_image(image_path, size)
+    if len(annual_rings_list) == 0:
+        write_image(f"{output_dir}/rings.png", base_image)
+        return
+
+    pith = Point(np.array(annual_rings_list[0].get_centroid(region=True).coords[0]) * scale)
+
+    def write_ring_debug_image(idx):
+        ring = annual_rings_list[idx]
+        image_debug = draw_ring_debug_image(base_image, ring, pith, scale, thickness)
+        write_image(f"{output_dir}/{idx}_ring_properties_label_{ring.main_label}.png", image_debug)
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        list(executor.map(write_ring_debug_image, range(len(annual_rings_list))))
+
+    write_image(f"{output_dir}/rings.png", draw_rings_image(base_image, annual_rings_list, scale, thickness))
 
     return
 
 
-def export_results(labelme_latewood_path: str = None, labelme_earlywood_path: str = None, image_path: str = None,
-                   metadata: dict = None,
-                   output_dir="output", draw=False):
+_previews_executor = None
+_previews_executor_lock = threading.Lock()
+
+
+class RingPreviews:
+    """
+    Ring previews rendered on demand and cached as thumbnails in cache_dir. The file name of a preview is a hash of the
+    ring geometry, the pith, the image file and the thumbnail size, so each preview is rendered once and reused while
+    the annotations and the image do not change. The image is only loaded when a preview has to be rendered.
+    """
+    def __init__(self, annual_rings_list, image_path, cache_dir, size=640):
+        self.annual_rings_list = annual_rings_list
+        self.image_path = image_path
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.size = size
+        self._base_image = None
+        self._lock = threading.Lock()
+        self.pith = (np.array(annual_rings_list[0].get_centroid(region=True).coords[0]) if len(annual_rings_list) > 0
+                     else None)
+        image_stat = os.stat(image_path)
+        image_key = f"{Path(image_path).resolve()}:{image_stat.st_mtime_ns}:{image_stat.st_size}:{size}".encode()
+        self.keys = [self._ring_key(ring, image_key) for ring in annual_rings_list]
+
+    def _ring_key(self, ring, image_key):
+        boundary = ring.early_wood.external_points if ring.early_wood is not None else None
+        hash_object = hashlib.sha1(image_key)
+        for points in (self.pith, ring.external_points, ring.internal_points, boundary):
+            hash_object.update(b"|")
+            if points is not None:
+                hash_object.update(np.ascontiguousarray(points, dtype=float).tobytes())
+        return hash_object.hexdigest()
+
+    def __len__(self):
+        return len(self.annual_rings_list)
+
+    def get_path(self, idx):
+        return self.cache_dir / f"{self.keys[idx]}.png"
+
+    def is_rendered(self, idx):
+        return self.get_path(idx).exists()
+
+    def _load_base_image(self):
+        with self._lock:
+            if self._base_image is None:
+                self._base_image, self.scale, self.thickness = load_base_image(self.image_path, self.size)
+        return self._base_image
+
+    def render(self, idx):
+        """
+        Render preview idx if it is not cached
+        @return: preview path
+        """
+        path = self.get_path(idx)
+        if path.exists():
+            return path
+        base_image = self._load_base_image()
+        image = draw_ring_debug_image(base_image, self.annual_rings_list[idx], Point(self.pith * self.scale),
+                                      self.scale, self.thickness)
+        # write and rename, so a partially written preview is never served
+        tmp_path = path.with_name(f"{path.stem}.{threading.get_ident()}.tmp.png")
+        write_image(str(tmp_path), image)
+        os.replace(tmp_path, path)
+        return path
+
+    def render_all(self, n_jobs=None):
+        """
+        Render the previews that are not cached, in a thread pool
+        @return: list of preview paths
+        """
+        missing = [idx for idx in range(len(self)) if not self.is_rendered(idx)]
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(self.render, missing))
+        return [self.get_path(idx) for idx in range(len(self))]
+
+    def submit_render_all(self):
+        """
+        Render the previews that are not cached in a background thread. Previews are written under their final name
+        once complete, so they can be served as soon as they are rendered
+        @return: future with the list of preview paths
+        """
+        global _previews_executor
+        with _previews_executor_lock:
+            if _previews_executor is None:
+                _previews_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ring_previews")
+        return _previews_executor.submit(self.render_all)
+
+    def write_rings_image(self, output_path):
+        base_image = self._load_base_image()
+        write_image(str(output_path), draw_rings_image(base_image, self.annual_rings_list, self.scale, self.thickness))
+
+
+def load_annual_rings(labelme_latewood_path: str, labelme_earlywood_path: str = None):
+    al_annual_rings = AL_AnnualRings(late_wood_path=Path(labelme_latewood_path),
+                                     early_wood_path=Path(labelme_earlywood_path) if labelme_earlywood_path else None)
+    return al_annual_rings.read()
+
+
+def compute_metrics(annual_rings_list, metadata: dict, output_dir="output"):
+    """
+    Compute the ring measurements table and save it as measurements.csv
+    @return: dataframe and table columns
+    """
     #metadata
     year = metadata["year"]
     year = datetime.datetime(year, 1, 1)
@@ -197,10 +381,6 @@ def export_results(labelme_latewood_path: str = None, labelme_earlywood_path: st
 
     unit = metadata.get("unit", "mm")
 
-    al_annual_rings = AL_AnnualRings(late_wood_path=Path(labelme_latewood_path),
-                                     early_wood_path=Path(labelme_earlywood_path) if labelme_earlywood_path else None)
-    annual_rings_list = al_annual_rings.read()
-
     (annual_ring_label_list, year_list, ew_lw_label_list, ring_area_list, ew_area_list, eccentricity_module_list,
      eccentricity_phase_list, ring_perimeter_list) = extract_ring_properties(annual_rings_list, year, plantation_date)
 
@@ -210,6 +390,14 @@ def export_results(labelme_latewood_path: str = None, labelme_earlywood_path: st
     )
 
     df.to_csv(f"{output_dir}/measurements.csv", index=False)
+    return df, table
+
+
+def export_results(labelme_latewood_path: str = None, labelme_earlywood_path: str = None, image_path: str = None,
+                   metadata: dict = None,
+                   output_dir="output", draw=False):
+    annual_rings_list = load_annual_rings(labelme_latewood_path, labelme_earlywood_path)
+    df, table = compute_metrics(annual_rings_list, metadata, output_dir)
     if draw:
         debug_images(annual_rings_list, df, image_path, output_dir)
 
@@ -218,105 +406,82 @@ def export_results(labelme_latewood_path: str = None, labelme_earlywood_path: st
     return
 
 
-def generate_plots(table, df, output_dir):
-    #pass
-    #Area bar plot
-    lw_area = df[table.lw_area]
-    ew_area = df[table.ew_area]
-    ring_area = df[table.ring_area]
-    year = df["Year"]
-    #convert year to int
-    year = year.astype(int)
-    from matplotlib import pyplot as plt
-    plt.figure()
+def draw_ew_lw_bar_plot(fig, year, ew_values, lw_values, ring_values, ylabel, title):
+    """
+    Earlywood and latewood stacked bars next to the ring bar of every year
+    """
+    ax = fig.add_subplot()
     bar_width = 0.25
-    plt.bar(year - bar_width / 2.1, ew_area, label="Earlywood", width=bar_width)
-    plt.bar(year - bar_width / 2.1, lw_area, bottom=ew_area, label="Latewood", width=bar_width)
-    plt.bar(year + bar_width / 2.1, ring_area, label="Ring", width=bar_width)
-
-    plt.xticks(year)
-    plt.grid(True)
-    #rotate xticks 90 degrees
-    plt.xticks(rotation=90)
-    plt.xlabel("Year")
-    plt.ylabel(f"Area [{table.unit}2]")
-    plt.legend()
-    plt.title("Ring Area Distribution")
-    plt.savefig(f"{output_dir}/area_bar_plot.png")
-    plt.close()
-
-    #ring width bar plot
-    lw_width = df[table.lw_width]
-    ew_width = df[table.ew_width]
-    ring_width = df[table.annual_ring_width]
-    plt.figure()
-    plt.bar(year - bar_width / 2.1, ew_width, label="Earlywood", width=bar_width)
-    plt.bar(year - bar_width / 2.1, lw_width, bottom=ew_width, label="Latewood", width=bar_width)
-    plt.bar(year + bar_width / 2.1, ring_width, label="Ring", width=bar_width)
-
-    plt.xticks(year)
-    plt.grid(True)
-    #rotate xticks 90 degrees
-    plt.xticks(rotation=90)
-    plt.xlabel("Year")
-    plt.ylabel(f"Width [{table.unit}]")
-    plt.legend()
-    plt.title("Ring Width Distribution")
-    plt.savefig(f"{output_dir}/width_bar_plot.png")
-    plt.close()
-
-    #ring cummulatives plot
-    ring_width = df[table.cumulative_radius]
-    plt.figure()
-    plt.plot(year, ring_width)
-    plt.xticks(year)
-    plt.grid(True)
-    #rotate xticks 90 degrees
-    plt.xticks(rotation=90)
-    plt.xlabel("Year")
-    plt.ylabel(f"Radius [{table.unit}]")
-    plt.title("Ring Cumulative Radius")
-    plt.savefig(f"{output_dir}/radius_plot.png")
-    plt.close()
-    return
-
-
-def generate_pdf(df, output_dir):
-    #generate pdf with plots
-    from fpdf import FPDF
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.add_page()
-    pdf.image(f"{output_dir}/rings.png", x=10, y=30, w=180)
-    pdf.add_page()
-    # pdf.set_font("Arial", size=12)
-    # pdf.cell(200, 10, txt="Annual Ring Metrics", ln=True, align="C")
-    pdf.set_font("Arial", size=10)
-    pdf.cell(200, 10, txt="Ring Area Distribution", ln=True, align="L")
-    pdf.image(f"{output_dir}/area_bar_plot.png", x=10, y=30, w=180)
-    pdf.add_page()
-
-    pdf.image(f"{output_dir}/width_bar_plot.png", x=10, y=30, w=180)
-    pdf.add_page()
-
-    pdf.image(f"{output_dir}/radius_plot.png", x=10, y=30, w=180)
-    pdf.add_page()
-
-    #extra pages for more details
-    #add page title
-    pdf.set_font("Arial", size=12)
-    pdf.cell(200, 10, txt="Ring Details", ln=True, align="C")
-
-    images_list = [f"{output_dir}/{idx}_ring_properties_label_{df.iloc[idx]["Annual Ring (label)"]}.png" for idx in
-                   range(df.shape[0])]
-    for idx, image in enumerate(images_list):
-        #add title "Ring idx"
-        pdf.set_font("Arial", size=10)
-        pdf.cell(200, 10, txt=f"Ring {df.iloc[idx]['Annual Ring (label)']}", ln=True, align="L")
-        pdf.image(image, x=10, y=30, w=180)
-        pdf.add_page()
-
-    pdf.output(f"{output_dir}/metrics.pdf")
+    ax.bar(year - bar_width / 2.1, ew_values, label="Earlywood", width=bar_width)
+    ax.bar(year - bar_width / 2.1, lw_values, bottom=ew_values, label="Latewood", width=bar_width)
+    ax.bar(year + bar_width / 2.1, ring_values, label="Ring", width=bar_width)
+    set_year_ticks(ax, year)
+    ax.grid(True)
+    ax.set_xlabel("Year")
+    ax.set_ylabel(ylabel)
+    ax.legend()
+    ax.set_title(title)
+
+
+def draw_year_line_plot(fig, year, values, ylabel, title):
+    ax = fig.add_subplot()
+    ax.plot(year, values)
+    set_year_ticks(ax, year)
+    ax.grid(True)
+    ax.set_xlabel("Year")
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+
+
+def generate_plots(table, df, output_dir, n_jobs=1):
+    """
+    Save the ring area, ring width and cumulative radius plots. Plots whose columns did not change since the last call
+    are not rendered again
+    @param table: measurements table columns
+    @param df: measurements dataframe
+    @param output_dir: output directory
+    @param n_jobs: number of processes used to render the plots. See lib.plots.render_plots
+    @return: list of rendered plots paths
+    """
+    year = df[table.year].to_numpy().astype(int)
+    jobs = [
+        PlotJob(draw_ew_lw_bar_plot, f"{output_dir}/area_bar_plot.png",
+                args=(year, df[table.ew_area].to_numpy(), df[table.lw_area].to_numpy(),
+                      df[table.ring_area].to_numpy(), f"Area [{table.unit}2]", "Ring Area Distribution")),
+        PlotJob(draw_ew_lw_bar_plot, f"{output_dir}/width_bar_plot.png",
+                args=(year, df[table.ew_width].to_numpy(), df[table.lw_width].to_numpy(),
+                      df[table.annual_ring_width].to_numpy(), f"Width [{table.unit}]", "Ring Width Distribution")),
+        PlotJob(draw_year_line_plot, f"{output_dir}/radius_plot.png",
+                args=(year, df[table.cumulative_radius].to_numpy(), f"Radius [{table.unit}]",
+                      "Ring Cumulative Radius"))
+    ]
+    return render_plots(jobs, n_jobs=n_jobs)
+
+
+def generate_pdf(df, output_dir, images_list=None, background=False, ring_previews=None):
+    """
+    Generate metrics.pdf with the rings image, the plots and the ring previews (see lib.report)
+    @param images_list: ring previews, one per df row. By default, the ones written by debug_images
+    @param background: if True, the report is built in a background thread and a future is returned
+    @param ring_previews: optional RingPreviews. Its missing previews are rendered before the report is built (in the
+    background thread if background) and they are used as images_list
+    """
+    labels = df[Table().main_label].tolist()
+    prepare = ring_previews.render_all if ring_previews is not None else None
+    if ring_previews is not None:
+        images_list = [ring_previews.get_path(idx) for idx in range(len(ring_previews))]
+    if images_list is None:
+        images_list = [f"{output_dir}/{idx}_ring_properties_label_{label}.png" for idx, label in enumerate(labels)]
+    args = (f"{output_dir}/metrics.pdf", labels, [str(image) for image in images_list])
+    kwargs = dict(rings_image=f"{output_dir}/rings.png",
+                  plots=[("Ring Area Distribution", f"{output_dir}/area_bar_plot.png"),
+                         ("Ring Width Distribution", f"{output_dir}/width_bar_plot.png"),
+                         ("Ring Cumulative Radius", f"{output_dir}/radius_plot.png")])
+    if background:
+        return submit_report(*args, prepare=prepare, **kwargs)
+    if prepare is not None:
+        prepare()
+    return generate_report(*args, **kwargs)
 
 
 class PathMetrics:
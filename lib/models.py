@@ -11,7 +11,7 @@ from automatic_methods.tree_ring_delineation.mlbrief_inbd.uruDendro.metric_influ
     InfluenceArea
 from backend.labelme_layer import (LabelmeInterface, LabelmeShapeType, AL_LateWood_EarlyWood, LabelmeShape,
                                    resize_annotations)
-from lib.image import resize_image_using_pil_lib, load_image, write_image
+from lib.image import resize_image_using_pil_lib, load_image, write_image, get_image_info
 from lib.io import get_python_path
 
 class LabelmeWriter(LabelmeInterface):
@@ -66,8 +66,7 @@ class Model:
         return resized_image_path
 
     def _sampling_polygons(self, dt_file, output_path, pith_mask_path):
-        image = load_image(self.image_path)
-        height, width, _ = image.shape
+        height, width, _ = get_image_info(self.image_path)
 
         pith_mask = load_image(pith_mask_path)
         pith_mask = cv2.cvtColor(pith_mask, cv2.COLOR_BGR2GRAY)
@@ -0,0 +1,227 @@
+"""
+Shared matplotlib plotting. Figures are drawn on reusable matplotlib.figure.Figure objects with an Agg canvas instead of
+pyplot global state, so the process wide matplotlib backend is left untouched. Each figure is described by a PlotJob: a
+top level drawing function plus its arguments, so jobs can be rendered in a process pool. A content hash of the
+arguments (DataFrame columns, numpy arrays, files and plain values) is stored next to every PNG and the figure is not
+rendered again while its data has not changed.
+"""
+import os
+import hashlib
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import MaxNLocator
+
+PLOT_CACHE_VERSION = 1
+DEFAULT_FIGSIZE = (6.4, 4.8)
+DEFAULT_DPI = 100
+# above this number of years, year axes are labelled with integer ticks chosen by matplotlib
+MAX_YEAR_TICKS = 30
+
+
+class PlotJob:
+    def __init__(self, draw_function, output_path, args=(), kwargs=None, figsize=DEFAULT_FIGSIZE, dpi=DEFAULT_DPI,
+                 hash_args=None):
+        """
+        One figure to be rendered
+        @param draw_function: top level function draw_function(fig, *args, **kwargs) that draws on an empty Figure
+        @param output_path: png path
+        @param args: drawing function positional arguments. They must be picklable to be rendered in a process pool
+        @param kwargs: drawing function keyword arguments
+        @param figsize: figure size in inches
+        @param dpi: figure resolution
+        @param hash_args: values hashed instead of args, if given. For example the image file (a pathlib.Path) instead
+        of its decoded pixels
+        """
+        self.draw_function = draw_function
+        self.output_path = Path(output_path)
+        self.args = tuple(args)
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.figsize = tuple(figsize)
+        self.dpi = dpi
+        self.hash_args = tuple(hash_args) if hash_args is not None else None
+
+    def content_hash(self):
+        args = self.hash_args if self.hash_args is not None else self.args
+        return content_hash(PLOT_CACHE_VERSION, self.draw_function, self.figsize, self.dpi, args, self.kwargs)
+
+
+def _update_hash(sha, value):
+    if isinstance(value, pd.DataFrame):
+        sha.update(f"DataFrame{list(value.columns)}{list(value.dtypes)}".encode())
+        sha.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, pd.Series):
+        sha.update(f"Series{value.name}{value.dtype}".encode())
+        sha.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, Path):
+        try:
+            stat = value.stat()
+            sha.update(f"Path{value.resolve()}{stat.st_mtime_ns}{stat.st_size}".encode())
+        except OSError:
+            sha.update(f"Path{value}".encode())
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        sha.update(f"ndarray{value.dtype.str}{value.shape}".encode())
+        sha.update(np.ascontiguousarray(value).data)
+    elif isinstance(value, (list, tuple)):
+        sha.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _update_hash(sha, item)
+    elif isinstance(value, dict):
+        sha.update(f"dict{len(value)}".encode())
+        for key in sorted(value, key=repr):
+            _update_hash(sha, key)
+            _update_hash(sha, value[key])
+    elif callable(value) and hasattr(value, "__qualname__"):
+        sha.update(f"function{value.__module__}.{value.__qualname__}".encode())
+    else:
+        sha.update(f"{type(value).__name__}{value!r}".encode())
+
+
+def content_hash(*values):
+    """
+    @return: sha1 hex digest of values. DataFrames and Series are hashed by content, columns names and dtypes, numpy
+    arrays by content, dtype and shape, files (pathlib.Path) by path, modification time and size, and containers
+    recursively
+    """
+    sha = hashlib.sha1()
+    for value in values:
+        _update_hash(sha, value)
+    return sha.hexdigest()
+
+
+def get_hash_path(output_path):
+    """
+    @return: content hash sidecar path of a png file. It is a hidden file in the same directory
+    """
+    output_path = Path(output_path)
+    return output_path.parent / f".{output_path.name}.hash"
+
+
+def is_up_to_date(output_path, digest):
+    """
+    @return: True if output_path exists and was rendered from data with content hash digest
+    """
+    if not Path(output_path).exists():
+        return False
+    try:
+        return get_hash_path(output_path).read_text() == digest
+    except OSError:
+        return False
+
+
+# figures are kept per thread: Streamlit runs each session script in its own thread, and a Figure must not be drawn
+# by two threads at once. They are released with their thread
+_thread_figures = threading.local()
+
+
+def get_figure(key, figsize=DEFAULT_FIGSIZE, dpi=DEFAULT_DPI):
+    """
+    Return an empty figure. Figures are kept per thread and key and cleared on reuse, instead of being created and
+    closed for every plot. They are not registered in pyplot
+    @param key: figure identifier, usually the drawing function
+    @param figsize: figure size in inches
+    @param dpi: figure resolution
+    @return: matplotlib.figure.Figure
+    """
+    figures = getattr(_thread_figures, "figures", None)
+    if figures is None:
+        figures = _thread_figures.figures = {}
+    fig = figures.get(key)
+    if fig is None:
+        fig = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(fig)
+        figures[key] = fig
+    else:
+        fig.clear()
+        fig.set_size_inches(figsize)
+        fig.set_dpi(dpi)
+    return fig
+
+
+def render_plot(job: PlotJob, digest=None):
+    """
+    Render a plot job unless its png is up to date. The png is written under a temporary name and renamed when complete
+    @param job: plot job
+    @param digest: job content hash, if already computed
+    @return: True if the figure was rendered, False if it was up to date
+    """
+    digest = job.content_hash() if digest is None else digest
+    if is_up_to_date(job.output_path, digest):
+        return False
+
+    job.output_path.parent.mkdir(parents=True, exist_ok=True)
+    fig = get_figure(job.draw_function, job.figsize, job.dpi)
+    job.draw_function(fig, *job.args, **job.kwargs)
+    tmp_output_path = f"{job.output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fig.savefig(tmp_output_path, format="png", dpi=job.dpi)
+    fig.clear()
+    os.replace(tmp_output_path, job.output_path)
+    try:
+        get_hash_path(job.output_path).write_text(digest)
+    except OSError:
+        # read only directory. The figure is rendered again next time
+        pass
+    return True
+
+
+_plot_executors = {}
+_plot_executors_lock = threading.Lock()
+
+
+def _get_executor(n_jobs):
+    """
+    @return: process pool with n_jobs workers. Pools are kept by number of workers and shared between threads, so a
+    pool is never shut down while another thread is using it
+    """
+    with _plot_executors_lock:
+        executor = _plot_executors.get(n_jobs)
+        if executor is None:
+            # spawned workers: forking a multi-threaded process (Streamlit server) can deadlock the child
+            executor = ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn"))
+            _plot_executors[n_jobs] = executor
+        return executor
+
+
+def render_plots(jobs: List[PlotJob], n_jobs=1):
+    """
+    Render plot jobs whose data changed since they were last rendered
+    @param jobs: plot jobs
+    @param n_jobs: number of processes. If 1, jobs are rendered in this process. If None, one process per CPU. The
+    process pool is kept between calls
+    @return: list of rendered png paths
+    """
+    digests = [job.content_hash() for job in jobs]
+    pending = [(job, digest) for job, digest in zip(jobs, digests) if not is_up_to_date(job.output_path, digest)]
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    if n_jobs <= 1 or len(pending) <= 1:
+        for job, digest in pending:
+            render_plot(job, digest)
+    else:
+        executor = _get_executor(n_jobs)
+        futures = [executor.submit(render_plot, job, digest) for job, digest in pending]
+        for future in futures:
+            future.result()
+
+    return [job.output_path for job, _ in pending]
+
+
+def set_year_ticks(ax, year, max_ticks=MAX_YEAR_TICKS):
+    """
+    Label every year if there are at most max_ticks of them, otherwise let matplotlib pick integer ticks
+    @param ax: axes whose x axis holds years
+    @param year: years array
+    @param max_ticks: maximum number of year labels
+    @return:
+    """
+    if len(year) <= max_ticks:
+        ax.set_xticks(year)
+    else:
+        ax.xaxis.set_major_locator(MaxNLocator(nbins=max_ticks, integer=True))
+    ax.tick_params(axis="x", labelrotation=90)
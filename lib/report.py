@@ -0,0 +1,172 @@
+"""
+PDF report of the ring measurements. Images are re-encoded as JPEG thumbnails sized for the print resolution before
+being embedded (FPDF embeds JPEG files as they are, while PNG files are decoded and re-compressed page by page), and
+ring previews are laid out in a grid. Reports can be built in a background thread.
+"""
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+from PIL import Image
+
+MM_PER_INCH = 25.4
+
+
+class ReportLayout:
+    """A4 portrait page, in millimeters"""
+    page_width = 210
+    page_height = 297
+    margin = 10
+    title_height = 10
+    caption_height = 6
+    grid_columns = 2
+    grid_rows = 3
+    grid_gap = 4
+    dpi = 150
+    jpeg_quality = 80
+
+
+def make_thumbnail(image_path, output_path, width_mm, height_mm=None, dpi=ReportLayout.dpi,
+                   quality=ReportLayout.jpeg_quality):
+    """
+    Re-encode an image as a JPEG that fits width_mm x height_mm at dpi. Images are only downscaled. Transparent
+    pixels are composed over white
+    @return: thumbnail (width, height) in pixels, or None if image_path does not exist
+    """
+    if not Path(image_path).exists():
+        return None
+    max_width = max(1, int(round(width_mm / MM_PER_INCH * dpi)))
+    max_height = max(1, int(round(height_mm / MM_PER_INCH * dpi))) if height_mm is not None else None
+    with Image.open(image_path) as image:
+        image.draft("RGB", (max_width, max_height or image.height))
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_width, max_height or image.height), Image.Resampling.LANCZOS)
+        image.save(output_path, "JPEG", quality=quality, optimize=True)
+        return image.size
+
+
+def _fit(size, width_mm, height_mm):
+    """
+    @return: width and height in millimeters of an image of size pixels scaled to fit in width_mm x height_mm
+    """
+    width, height = size
+    factor = min(width_mm / width, height_mm / height)
+    return width * factor, height * factor
+
+
+def generate_report(output_path, labels: List, images_list: List, rings_image=None, plots: List = None,
+                    layout=ReportLayout, n_jobs=None):
+    """
+    Build the measurements report. Missing images are skipped
+    @param output_path: pdf path. The file is written under a temporary name and renamed when complete
+    @param labels: ring labels, one per ring preview
+    @param images_list: ring previews paths
+    @param rings_image: image of all the rings, shown in the first page
+    @param plots: list of (title, plot image path). Each plot takes a page
+    @param layout: page layout
+    @param n_jobs: threads used to build the thumbnails
+    @return: output_path
+    """
+    from fpdf import FPDF
+    plots = plots if plots is not None else []
+    content_width = layout.page_width - 2 * layout.margin
+    content_height = layout.page_height - 2 * layout.margin - layout.title_height
+    cell_width = (content_width - (layout.grid_columns - 1) * layout.grid_gap) / layout.grid_columns
+    cell_height = (content_height - (layout.grid_rows - 1) * layout.grid_gap) / layout.grid_rows
+    image_cell_height = cell_height - layout.caption_height
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # every image is reduced to the box it is printed in. Thumbnails are built in parallel (PIL releases the GIL)
+        page_images = [rings_image] + [path for _, path in plots]
+        boxes = ([(content_width, content_height)] * len(page_images) +
+                 [(cell_width, image_cell_height)] * len(images_list))
+        sources = page_images + list(images_list)
+        thumbnails = [os.path.join(tmp_dir, f"{idx}.jpg") for idx in range(len(sources))]
+
+        def build_thumbnail(idx):
+            if sources[idx] is None:
+                return None
+            width_mm, height_mm = boxes[idx]
+            return make_thumbnail(sources[idx], thumbnails[idx], width_mm, height_mm, layout.dpi, layout.jpeg_quality)
+
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            sizes = list(executor.map(build_thumbnail, range(len(sources))))
+
+        pdf = FPDF(unit="mm", format="A4")
+        pdf.set_auto_page_break(auto=False)
+
+        def add_page_image(title, idx):
+            if sizes[idx] is None:
+                return
+            pdf.add_page()
+            pdf.set_font("Arial", size=10)
+            if title:
+                pdf.cell(content_width, layout.title_height, txt=title, ln=True, align="L")
+            width, height = _fit(sizes[idx], content_width, content_height)
+            pdf.image(thumbnails[idx], x=layout.margin, y=layout.margin + layout.title_height, w=width, h=height)
+
+        add_page_image(None, 0)
+        for plot_idx, (title, _) in enumerate(plots):
+            add_page_image(title, plot_idx + 1)
+
+        # ring details grid
+        first_ring = len(page_images)
+        per_page = layout.grid_columns * layout.grid_rows
+        for ring_idx, label in enumerate(labels[:len(images_list)]):
+            cell = ring_idx % per_page
+            if cell == 0:
+                pdf.add_page()
+                pdf.set_font("Arial", size=12)
+                pdf.cell(content_width, layout.title_height, txt="Ring Details", ln=True, align="C")
+                pdf.set_font("Arial", size=10)
+            row, column = divmod(cell, layout.grid_columns)
+            x = layout.margin + column * (cell_width + layout.grid_gap)
+            y = layout.margin + layout.title_height + row * (cell_height + layout.grid_gap)
+            pdf.set_xy(x, y)
+            pdf.cell(cell_width, layout.caption_height, txt=f"Ring {label}", align="L")
+            size = sizes[first_ring + ring_idx]
+            if size is None:
+                continue
+            width, height = _fit(size, cell_width, image_cell_height)
+            pdf.image(thumbnails[first_ring + ring_idx], x=x, y=y + layout.caption_height, w=width, h=height)
+
+        if pdf.page == 0:
+            pdf.add_page()
+        tmp_output_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        pdf.output(tmp_output_path)
+    os.replace(tmp_output_path, output_path)
+    return output_path
+
+
+_report_executor = None
+_report_executor_lock = threading.Lock()
+
+
+def _build_report(prepare, *args, **kwargs):
+    if prepare is not None:
+        prepare()
+    return generate_report(*args, **kwargs)
+
+
+def submit_report(*args, prepare=None, **kwargs):
+    """
+    Build the report in a background thread. Thumbnails are built by PIL, which releases the GIL, so the calling
+    thread is barely slowed down. Arguments as generate_report
+    @param prepare: optional callable run in the background thread before the report is built, e.g. to render the
+    images it embeds
+    @return: future with the report path, or with the exception raised while building it
+    """
+    global _report_executor
+    with _report_executor_lock:
+        if _report_executor is None:
+            _report_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="report")
+    return _report_executor.submit(_build_report, prepare, *args, **kwargs)
@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+# modules are imported from the repository root, as app.py does
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def labelme_cache_dir(tmp_path, monkeypatch):
+    # labelme caches are written under the test directory instead of the application output directory
+    import lib.labelme_cache
+    cache_dir = tmp_path / "labelme_cache"
+    monkeypatch.setattr(lib.labelme_cache, "DEFAULT_CACHE_DIR", cache_dir)
+    return cache_dir
@@ -0,0 +1,60 @@
+import numpy as np
+
+from lib.cstrd_lib.chain import Chain, ClockDirection, Node, copy_chain
+
+
+def build_chain(chain_id=1):
+    chain = Chain(chain_id, 360, (100, 100), 200, 200)
+    chain.add_nodes_list([Node(x=100 + 10 * np.cos(np.deg2rad(angle)), y=100 + 10 * np.sin(np.deg2rad(angle)),
+                               chain_id=chain_id, radial_distance=10, angle=angle) for angle in range(0, 360, 10)])
+    return chain
+
+
+def chain_ids(l_nodes):
+    return {node.chain_id for node in l_nodes}
+
+
+def test_copy_chain_source_change_id_keeps_node_identity():
+    chain = build_chain()
+    global_nodes = list(chain.l_nodes)
+    aux_chain = copy_chain(chain)
+
+    chain.change_id(7)
+    assert all(node is global_node for node, global_node in zip(chain.l_nodes, global_nodes))
+    assert chain_ids(global_nodes) == {7}
+    assert chain_ids(aux_chain.l_nodes) == {1}
+
+
+def test_copy_chain_copy_change_id_does_not_modify_source():
+    chain = build_chain()
+    global_nodes = list(chain.l_nodes)
+    aux_chain = copy_chain(chain)
+    aux_copy = copy_chain(aux_chain)
+
+    aux_chain.change_id(9)
+    assert chain_ids(aux_chain.l_nodes) == {9}
+    assert chain_ids(global_nodes) == {1}
+    assert chain_ids(aux_copy.l_nodes) == {1}
+
+    chain.change_id(7)
+    assert chain_ids(global_nodes) == {7}
+    assert chain_ids(aux_copy.l_nodes) == {1}
+
+
+def build_arc(angles, chain_id=1):
+    return [Node(x=100 + 10 * np.cos(np.deg2rad(angle)), y=100 + 10 * np.sin(np.deg2rad(angle)), chain_id=chain_id,
+                 radial_distance=10, angle=angle) for angle in angles]
+
+
+def test_sorted_dots_are_a_snapshot():
+    chain = Chain(1, 360, (100, 100), 200, 200)
+    chain.add_nodes_list(build_arc(list(range(350, 360)) + list(range(0, 20))))
+    clockwise = chain.sort_dots(ClockDirection.clockwise)
+    anti_clockwise = chain.sort_dots(ClockDirection.anti_clockwise)
+    assert [node.angle for node in clockwise] == list(range(19, -1, -1)) + list(range(359, 349, -1))
+    assert [node.angle for node in anti_clockwise] == list(range(350, 360)) + list(range(0, 20))
+
+    chain.add_nodes_list(build_arc(range(20, 30)))
+    assert len(clockwise) == len(anti_clockwise) == 30
+    assert [node.angle for node in chain.sort_dots(ClockDirection.anti_clockwise)] == \
+        list(range(350, 360)) + list(range(0, 30))
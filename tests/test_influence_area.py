@@ -0,0 +1,83 @@
+import json
+import warnings
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from lib.cstrd_lib.metric_influence_area import InfluenceArea, InfluenceMode, get_influence_label_image
+
+HEIGHT, WIDTH = 160, 200
+CENTER = (75, 95)
+
+
+def ring_points(rng, radius, n_points=120, noise=0.0):
+    theta = np.linspace(0, 2 * np.pi, n_points, endpoint=False)
+    radii = radius + 4 * np.sin(3 * theta) + rng.normal(0, noise, n_points)
+    # labelme points are (x, y)
+    return np.column_stack((CENTER[1] + radii * np.sin(theta), CENTER[0] + radii * np.cos(theta))).tolist()
+
+
+def write_labelme(path, l_points):
+    shapes = [dict(label=str(i), points=points, shape_type="polygon", flags={}) for i, points in enumerate(l_points)]
+    path.write_text(json.dumps(dict(version="5", flags={}, shapes=shapes, imagePath="img.png", imageData=None,
+                                    imageHeight=HEIGHT, imageWidth=WIDTH)))
+
+
+@pytest.fixture(params=[0, 1, 2])
+def annotations(request, tmp_path):
+    rng = np.random.default_rng(request.param)
+    # the outer rings, and the mirrored outer bound of the last one, cross the image border
+    gt_radii = np.cumsum(rng.uniform(10, 22, 6)) + 5
+    dt_radii = [radius + rng.normal(0, 3) for k, radius in enumerate(gt_radii) if k != 2] + [gt_radii[2] + 9]
+    write_labelme(tmp_path / "gt.json", [ring_points(rng, radius) for radius in gt_radii])
+    write_labelme(tmp_path / "dt.json", [ring_points(rng, radius, noise=1.5) for radius in dt_radii])
+    cv.imwrite(str(tmp_path / "img.png"), np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8))
+    return tmp_path
+
+
+def evaluate(directory, mode, threshold=0.6):
+    metrics = InfluenceArea(directory / "gt.json", directory / "dt.json", directory / "img.png", directory / mode,
+                            threshold, CENTER[0], CENTER[1], Nr=90, mode=mode)
+    indicators = metrics.compute_indicators(plot=False)
+    return metrics, indicators
+
+
+def test_polar_mode_matches_raster_mode(annotations):
+    raster, raster_indicators = evaluate(annotations, InfluenceMode.raster)
+    polar, polar_indicators = evaluate(annotations, InfluenceMode.polar)
+
+    assert polar_indicators == raster_indicators
+    assert polar.dt_and_gt_assignation == raster.dt_and_gt_assignation
+    np.testing.assert_array_equal(polar.raw_accuracy_percentage, raster.raw_accuracy_percentage)
+    np.testing.assert_array_equal(get_influence_label_image(polar.get_results()),
+                                  get_influence_label_image(raster.get_results()))
+
+
+def test_detection_outside_every_influence_area_keeps_lists_aligned(tmp_path):
+    rng = np.random.default_rng(0)
+    gt_radii = [10, 20, 30]
+    # the largest detection is outside the mirrored outer bound of the last gt ring
+    write_labelme(tmp_path / "gt.json", [ring_points(rng, radius) for radius in gt_radii])
+    write_labelme(tmp_path / "dt.json", [ring_points(rng, radius) for radius in (60, 10.5, 20.5, 30.5)])
+    cv.imwrite(str(tmp_path / "img.png"), np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8))
+
+    metrics, indicators = evaluate(tmp_path, InfluenceMode.raster, threshold=0.5)
+
+    assert metrics.dt_and_gt_assignation == [0, 1, 2, -1]
+    assert len(metrics.accuracy_percentage) == len(metrics.raw_accuracy_percentage) == len(metrics.dt_poly)
+    assert metrics.accuracy_percentage[-1] == metrics.raw_accuracy_percentage[-1] == -1
+    assert indicators == (3, 1, 0, 0)
+    sweep = metrics.compute_threshold_sweep([0.5])
+    assert (sweep["TP"][0], sweep["FP"][0], sweep["FN"][0]) == (3, 1, 0)
+
+
+def test_rmse_without_common_rays_is_nan(annotations):
+    metrics, _ = evaluate(annotations, InfluenceMode.raster)
+    dt_poly, gt_poly = metrics.dt_poly[0], metrics.gt_poly[0]
+    half = np.arange(metrics.Nr) < metrics.Nr // 2
+    dt_poly.mask &= half
+    gt_poly.mask &= ~half
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert np.isnan(metrics.compute_rmse_between_dt_and_gt(dt_poly, gt_poly))
@@ -0,0 +1,16 @@
+import json
+
+from lib.io import load_json
+
+
+def test_load_json_skips_image_data(tmp_path):
+    content = dict(shapes=[dict(label='escaped \\" and "imageData": "text"', points=[[1, 2]])], imageData="QUJD\\/",
+                   imagePath="img.png")
+    path = tmp_path / "labelme.json"
+    path.write_text(json.dumps(content, indent=2).replace('"imageData": "Q', '"imageData" : "Q'))
+
+    data = load_json(path, skip_image_data=True)
+    assert data["imageData"] is None
+    assert data["shapes"] == content["shapes"]
+    assert data["imagePath"] == "img.png"
+    assert load_json(path)["imageData"] == content["imageData"]
@@ -0,0 +1,40 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from lib.labelme_cache import get_cache_paths, load_labelme_arrays
+
+
+@pytest.fixture
+def labelme_file(tmp_path):
+    annotations = tmp_path / "annotations"
+    annotations.mkdir()
+    path = annotations / "rings.json"
+    shapes = [dict(label="1", points=[[0, 0], [10, 0], [10, 10], [0, 10]], shape_type="polygon", flags={})]
+    path.write_text(json.dumps(dict(version="5", flags={}, shapes=shapes, imagePath="img.png", imageData=None)))
+    return path
+
+
+def test_cache_is_written_in_the_cache_dir(labelme_file, labelme_cache_dir):
+    arrays = load_labelme_arrays(labelme_file)
+    assert sorted(os.listdir(labelme_file.parent)) == ["rings.json"]
+    assert all(path.parent == labelme_cache_dir and path.exists() for path in get_cache_paths(labelme_file))
+
+    cached = load_labelme_arrays(labelme_file)
+    np.testing.assert_array_equal(cached.points, arrays.points)
+
+
+def test_unwritable_cache_dir_is_tolerated(labelme_file, labelme_cache_dir, monkeypatch):
+    def replace(*args):
+        raise PermissionError("read only")
+
+    monkeypatch.setattr("lib.labelme_cache.os.replace", replace)
+    arrays = load_labelme_arrays(labelme_file)
+    assert len(arrays) == 1
+    assert os.listdir(labelme_cache_dir) == []
+
+    # a cache directory that cannot be created
+    arrays = load_labelme_arrays(labelme_file, cache_dir=labelme_file / "cache")
+    assert len(arrays) == 1
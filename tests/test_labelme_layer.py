@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from shapely.geometry import Polygon
+
+from backend.labelme_layer import EarlyWoodSweep, LabelmeShape, LabelmeShapeType, sort_shapes_by_area
+
+
+def ring_shape(label, radius, center=(200, 200), n_points=90):
+    theta = np.linspace(0, 2 * np.pi, n_points, endpoint=False)
+    points = np.column_stack((center[1] + radius * np.sin(theta), center[0] + radius * np.cos(theta)))
+    return LabelmeShape(dict(label=label, points=points.tolist(), shape_type=LabelmeShapeType.polygon, flags={}))
+
+
+def quadratic_pairing(late_ring, previous_ring, early_rings_list):
+    """Original AL_AnnualRings.get_early_ring_within_late_rings loop, without drawing"""
+    if previous_ring is None:
+        return None
+    region = Polygon(Polygon(late_ring.points).exterior.coords, [Polygon(previous_ring.points).exterior.coords])
+    early = None
+    for early in early_rings_list:
+        if Polygon(early.points).intersects(region):
+            break
+    return early
+
+
+def build_rings(seed):
+    rng = np.random.default_rng(seed)
+    late_radii = np.cumsum(rng.uniform(8, 20, 8))
+    late = [ring_shape(f"late_{idx}", radius, center=(200 + rng.normal(0, 3), 200 + rng.normal(0, 3)))
+            for idx, radius in enumerate(late_radii)]
+    # some bands have no earlywood ring, the outer ones included, and some earlywood rings cross a latewood ring
+    early = [ring_shape(f"early_{idx}", radius - rng.uniform(1, 7), center=(200 + rng.normal(0, 3),
+                                                                           200 + rng.normal(0, 3)))
+             for idx, radius in enumerate(late_radii[:-2]) if rng.random() > 0.25]
+    late = sort_shapes_by_area(late)
+    if seed % 2 == 1:
+        # rings that are not nested, as crossing annotations
+        late[3], late[4] = late[4], late[3]
+    return late, sort_shapes_by_area(early)
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_sweep_matches_quadratic_pairing(seed):
+    late, early = build_rings(seed)
+    sweep = EarlyWoodSweep(early)
+    previous = None
+    for late_ring in late:
+        expected = quadratic_pairing(late_ring, previous, early)
+        assert sweep.match(late_ring, previous) is expected
+        previous = late_ring
@@ -6,7 +6,7 @@ import os
 from shapely.geometry import Polygon, Point
 from pathlib import Path
 
-from lib.image import  Drawing, Color, load_image, write_image
+from lib.image import  Drawing, Color, load_image, write_image, get_image_info
 from lib.io import load_json, write_binary_file
 from lib.inbd import INBD
 from lib.cstrd import CSTRD
@@ -74,7 +74,8 @@ class PithInterface(UserInterface):
 
     def generate_center_mask(self, output_path, results):
         if self.pith_model == Pith.pixel:
-            mask = np.zeros(load_image(self.read_file_path).shape[:2], dtype=np.uint8)
+            height, width, _ = get_image_info(self.read_file_path)
+            mask = np.zeros((height, width), dtype=np.uint8)
             x,y = results.xy
             x = int(x[0])
             y = int(y[0])
@@ -82,8 +83,8 @@ class PithInterface(UserInterface):
             write_image(output_path, mask)
             return
 
-        image = load_image(self.read_file_path)
-        mask = np.zeros(image.shape, dtype=np.uint8)
+        height, width, channels = get_image_info(self.read_file_path)
+        mask = np.zeros((height, width) if channels == 1 else (height, width, channels), dtype=np.uint8)
         mask = Drawing.fill(results.exterior, mask, Color.white, opacity=1)
         write_image(str(output_path), mask)
         return
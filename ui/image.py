@@ -8,7 +8,7 @@ from PIL import Image
 from streamlit_option_menu import option_menu
 from pathlib import Path
 
-from lib.image import resize_image_using_pil_lib, load_image, write_image
+from lib.image import resize_image_using_pil_lib, load_image, write_image, get_image_info
 from lib.io import load_json
 from ui.common import Context, RunningWidget
 from backend.labelme_layer import (LabelmeShapeType,
@@ -113,10 +113,12 @@ def set_date_input(dictionary_date, text="Tree planting date"):
     return dictionary_date
 
 def resize_image(image_path : Path, resize_factor : float):
-    image = load_image(image_path)
-    H, W = image.shape[:2]
+    H, W, _ = get_image_info(image_path)
     H_new = int(H  / resize_factor)
     W_new = int(W  / resize_factor)
+    if (H_new, W_new) == (H, W):
+        return str(image_path)
+    image = load_image(image_path)
     image = resize_image_using_pil_lib(image,  H_new, W_new)
     write_image(str(image_path), image)
     return str(image_path)
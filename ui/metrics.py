@@ -13,7 +13,8 @@ from shapely.geometry import LineString, MultiLineString, Polygon, Point, MultiP
 
 from lib.image import  Color as ColorCV2, Drawing, load_image, write_image, resize_image_using_pil_lib
 from ui.common import Context, RunningWidget
-from lib.metrics import  export_results, Table
+from lib.io import load_json, write_json
+from lib.metrics import  Table, RingPreviews, load_annual_rings, compute_metrics, generate_plots, generate_pdf
 from backend.labelme_layer import (LabelmeShapeType,
                                    LabelmeObject, LabelmeInterface as UserInterface)
 
@@ -93,6 +94,15 @@ class ViewContext(Context):
 
 
 
+RING_PREVIEWS_DIR = "ring_previews"
+RING_PREVIEWS_INDEX = "ring_previews.json"
+# session state key of the background metrics report future
+METRICS_REPORT_KEY = "metrics_report_future"
+# session state keys of the ring previews of the last run, and of their background rendering future
+RING_PREVIEWS_KEY = "ring_previews"
+RING_PREVIEWS_FUTURE_KEY = "ring_previews_future"
+
+
 def encode_image_to_base64(image_path):
     with open(image_path, "rb") as image_file:
         encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
@@ -208,6 +218,76 @@ class UI:
 
 
 
+    @staticmethod
+    def get_ring_previews_dir():
+        #get python file path
+        script_path = os.path.abspath(__file__)
+        root = Path(script_path).parent.parent
+        return Path(root) / "static" / RING_PREVIEWS_DIR
+
+    def get_ring_previews_urls(self, preview_names, n_rows):
+        """
+        @return: static url of each cached ring preview, None if it is not rendered yet
+        """
+        previews_dir = self.get_ring_previews_dir()
+        urls = [f"app/static/{RING_PREVIEWS_DIR}/{name}" if (previews_dir / name).exists() else None
+                for name in preview_names[:n_rows]]
+        return urls + [None] * (n_rows - len(urls))
+
+    def display_table(self, placeholder, key):
+        placeholder.data_editor(self.df,
+                                column_config= {
+                                    'image': st.column_config.ImageColumn('Preview Ring', help="Preview Ring")
+                                },
+                                hide_index = True,
+                                key = key
+        )
+
+    def get_ring_previews(self, previews_index_path, previews_index):
+        """
+        Ring previews of the last run. They are kept in the session state while the previews index does not change,
+        so the annotations are not read again on every rerun
+        """
+        key = (str(previews_index_path), previews_index_path.stat().st_mtime_ns)
+        cached = st.session_state.get(RING_PREVIEWS_KEY)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        annual_rings_list = load_annual_rings(previews_index["latewood"], previews_index["earlywood"])
+        ring_previews = RingPreviews(annual_rings_list, previews_index["image_path"], self.get_ring_previews_dir())
+        st.session_state[RING_PREVIEWS_KEY] = (key, ring_previews)
+        return ring_previews
+
+    @staticmethod
+    def submit_ring_previews(ring_previews):
+        """
+        Render the missing ring previews in the background, unless the report or a former request is already doing it.
+        Rendered previews are picked up by the next rerun
+        """
+        for future_key in (METRICS_REPORT_KEY, RING_PREVIEWS_FUTURE_KEY):
+            future = st.session_state.get(future_key)
+            if future is not None and not future.done():
+                break
+        else:
+            st.session_state[RING_PREVIEWS_FUTURE_KEY] = ring_previews.submit_render_all()
+        st.info("Rendering ring previews. They are shown once rendered, on the next rerun")
+
+    @staticmethod
+    def display_report_status():
+        """
+        Show the state of the metrics report built in the background by the last run of this session
+        """
+        future = st.session_state.get(METRICS_REPORT_KEY)
+        if future is None:
+            return
+        if not future.done():
+            st.info("Building the metrics report (metrics.pdf)...")
+            return
+        error = future.exception()
+        if error is not None:
+            st.error(f"The metrics report could not be built: {error!r}")
+        else:
+            st.success(f"Metrics report ready: {future.result()}")
+
     def run_metrics(self):
         if not self.CTX.scale_status:
             os.system(f"rm -rf {self.CTX.output_dir_metrics}")
@@ -238,12 +318,17 @@ class UI:
             else:
                 ew_file_path = None
             gif_running = RunningWidget()
-            export_results(labelme_latewood_path= lw_file_path,
-                           labelme_earlywood_path= ew_file_path,
-                           image_path=self.CTX.image_path,
-                           metadata=metadata,
-                           draw=True,
-                           output_dir=self.CTX.output_dir_metrics)
+            annual_rings_list = load_annual_rings(lw_file_path, ew_file_path)
+            df, table = compute_metrics(annual_rings_list, metadata, self.CTX.output_dir_metrics)
+            ring_previews = RingPreviews(annual_rings_list, self.CTX.image_path, self.get_ring_previews_dir())
+            ring_previews.write_rings_image(self.CTX.output_dir_metrics / "rings.png")
+            previews_index_path = self.CTX.output_dir_metrics / RING_PREVIEWS_INDEX
+            write_json(dict(latewood=str(lw_file_path), earlywood=str(ew_file_path) if ew_file_path else None,
+                            image_path=str(self.CTX.image_path),
+                            previews=[ring_previews.get_path(idx).name for idx in range(len(ring_previews))]),
+                       previews_index_path)
+            st.session_state[RING_PREVIEWS_KEY] = ((str(previews_index_path), previews_index_path.stat().st_mtime_ns),
+                                                   ring_previews)
             gif_running.empty()
 
         self.dataframe_file = self.CTX.output_dir_metrics / "measurements.csv"
@@ -267,34 +352,24 @@ class UI:
         columns = select_columns_to_display(self.CTX, table)
         self.df = self.df[columns]
 
-        ring_images = [str(image_path) for image_path in self.CTX.output_dir_metrics.glob("*_ring_properties*.png")]
-        from natsort import natsorted
-        ring_images = natsorted(ring_images)
-        base64_images = []
-        #get python file path
-        script_path = os.path.abspath(__file__)
-        root = Path(script_path).parent.parent
-        static_files_dir = Path(root) / "static"
-        static_files_dir.mkdir(parents=True, exist_ok=True)
-        for image_path in ring_images:
-            #copy image_path to static_files_dir
-            os.system(f"cp {image_path} {static_files_dir}")
-            base64_images.append(f"app/static/{Path(image_path).name}")
-
-        self.df['image'] = base64_images
-        #put 'image' column as first
-        cols = self.df.columns.tolist()
-        cols = cols[-1:] + cols[:-1]
-        self.df = self.df[cols]
-
-
-
-        st.data_editor(self.df,
-                       column_config= {
-                           'image': st.column_config.ImageColumn('Preview Ring', help="Preview Ring")
-                       },
-                       hide_index = True
-        )
+        # the table is shown as soon as the measurements are available. Ring previews are served from the cache in
+        # static/ and the missing ones are rendered in the background (by the report on a run)
+        previews_index_path = self.CTX.output_dir_metrics / RING_PREVIEWS_INDEX
+        previews_index = load_json(previews_index_path) if previews_index_path.exists() else None
+        preview_names = previews_index["previews"] if previews_index is not None else []
+        self.df.insert(0, 'image', self.get_ring_previews_urls(preview_names, self.df.shape[0]))
+        self.display_table(st.empty(), key="metrics_table")
+
+        if run_button:
+            generate_plots(table, df, self.CTX.output_dir_metrics)
+            # the report is built in a background thread, after the missing ring previews. The page does not wait
+            st.session_state[METRICS_REPORT_KEY] = generate_pdf(df, self.CTX.output_dir_metrics,
+                                                                ring_previews=ring_previews, background=True)
+
+        if previews_index is not None and self.df['image'].isnull().any():
+            self.submit_ring_previews(self.get_ring_previews(previews_index_path, previews_index))
+        self.display_report_status()
+
         height, width = image.shape[:2]
         height, width = 800, 400
         image_z = resize_image_using_pil_lib(image, height, width)